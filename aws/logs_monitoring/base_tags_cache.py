@@ -3,6 +3,7 @@ import os
 import json
 import datetime
 import re
+import threading
 from collections import defaultdict
 from time import time
 from random import randint
@@ -13,6 +14,10 @@ from botocore.exceptions import ClientError
 from settings import (
     DD_S3_BUCKET_NAME,
     DD_TAGS_CACHE_TTL_SECONDS,
+    DD_TAGS_CACHE_NEGATIVE_TTL_SECONDS,
+    DD_TAGS_CACHE_ERROR_TTL_SECONDS,
+    DD_TAGS_CACHE_REFRESH_AHEAD_SECONDS,
+    DD_TAGS_CACHE_GET_BUDGET_SECONDS,
     DD_S3_CACHE_LOCK_TTL_SECONDS,
 )
 from telemetry import (
@@ -24,7 +29,9 @@ JITTER_MIN = 1
 JITTER_MAX = 100
 
 DD_TAGS_CACHE_TTL_SECONDS = DD_TAGS_CACHE_TTL_SECONDS + randint(JITTER_MIN, JITTER_MAX)
-s3_client = boto3.resource("s3")
+# Shared by the threads refreshing the caches, boto3 clients are thread safe
+# unlike resources
+s3_client = boto3.client("s3")
 
 logger = logging.getLogger()
 
@@ -108,33 +115,73 @@ def get_last_modified_time(s3_file):
     return last_modified_unix_time
 
 
+# Statuses of the tags fetched for a single key
+TAGS_FOUND = "found"
+TAGS_NOT_FOUND = "not_found"
+TAGS_FETCH_ERROR = "error"
+
+
+class TagsCacheEntry(object):
+    """Metadata of the tags fetched for a single key, outside of the full refreshes"""
+
+    __slots__ = ("fetched_at", "status", "ttl_seconds", "failures")
+
+    def __init__(self, fetched_at, status, ttl_seconds, failures=0):
+        self.fetched_at = fetched_at
+        self.status = status
+        self.ttl_seconds = ttl_seconds
+        self.failures = failures
+
+    def is_expired(self):
+        return time() > self.fetched_at + self.ttl_seconds
+
+
 class BaseTagsCache(object):
     CACHE_FILENAME = None
     CACHE_LOCK_FILENAME = None
 
-    def __init__(self, tags_ttl_seconds=DD_TAGS_CACHE_TTL_SECONDS):
+    def __init__(
+        self,
+        tags_ttl_seconds=DD_TAGS_CACHE_TTL_SECONDS,
+        refresh_ahead_seconds=DD_TAGS_CACHE_REFRESH_AHEAD_SECONDS,
+        get_budget_seconds=DD_TAGS_CACHE_GET_BUDGET_SECONDS,
+        negative_ttl_seconds=DD_TAGS_CACHE_NEGATIVE_TTL_SECONDS,
+        error_ttl_seconds=DD_TAGS_CACHE_ERROR_TTL_SECONDS,
+    ):
         self.tags_ttl_seconds = tags_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.error_ttl_seconds = error_ttl_seconds
+        # Leave at least half of the TTL between two refreshes
+        self.refresh_ahead_seconds = min(refresh_ahead_seconds, tags_ttl_seconds / 2)
+        self.get_budget_seconds = get_budget_seconds
 
         self.tags_by_id = {}
+        # The metadata of the keys whose tags were fetched on their own
+        self.entries = {}
         self.last_tags_fetch_time = 0
+        self._refresh_thread = None
+        # Guards tags_by_id and entries, set by the refresh thread and by `get`
+        self._lock = threading.Lock()
 
     def write_cache_to_s3(self, data):
         """Writes tags cache to s3"""
         try:
             logger.debug("Trying to write data to s3: {}".format(data))
-            s3_object = s3_client.Object(DD_S3_BUCKET_NAME, self.CACHE_FILENAME)
-            s3_object.put(Body=(bytes(json.dumps(data).encode("UTF-8"))))
+            s3_client.put_object(
+                Bucket=DD_S3_BUCKET_NAME,
+                Key=self.CACHE_FILENAME,
+                Body=(bytes(json.dumps(data).encode("UTF-8"))),
+            )
         except ClientError:
             send_forwarder_internal_metrics("s3_cache_write_failure")
             logger.debug("Unable to write new cache to S3", exc_info=True)
 
     def acquire_s3_cache_lock(self):
         """Acquire cache lock"""
-        cache_lock_object = s3_client.Object(
-            DD_S3_BUCKET_NAME, self.CACHE_LOCK_FILENAME
-        )
         try:
-            file_content = cache_lock_object.get()
+            file_content = s3_client.get_object(
+                Bucket=DD_S3_BUCKET_NAME, Key=self.CACHE_LOCK_FILENAME
+            )
 
             # check lock file expiration
             last_modified_unix_time = get_last_modified_time(file_content)
@@ -145,7 +192,11 @@ class BaseTagsCache(object):
 
         # lock file doesn't exist, create file to acquire lock
         try:
-            cache_lock_object.put(Body=(bytes("lock".encode("UTF-8"))))
+            s3_client.put_object(
+                Bucket=DD_S3_BUCKET_NAME,
+                Key=self.CACHE_LOCK_FILENAME,
+                Body=(bytes("lock".encode("UTF-8"))),
+            )
             send_forwarder_internal_metrics("s3_cache_lock_acquired")
             logger.debug("S3 cache lock acquired")
         except ClientError:
@@ -157,10 +208,9 @@ class BaseTagsCache(object):
     def release_s3_cache_lock(self):
         """Release cache lock"""
         try:
-            cache_lock_object = s3_client.Object(
-                DD_S3_BUCKET_NAME, self.CACHE_LOCK_FILENAME
+            s3_client.delete_object(
+                Bucket=DD_S3_BUCKET_NAME, Key=self.CACHE_LOCK_FILENAME
             )
-            cache_lock_object.delete()
             send_forwarder_internal_metrics("s3_cache_lock_released")
             logger.debug("S3 cache lock released")
         except ClientError:
@@ -170,9 +220,10 @@ class BaseTagsCache(object):
     def get_cache_from_s3(self):
         """Retrieves tags cache from s3 and returns the body along with
         the last modified datetime for the cache"""
-        cache_object = s3_client.Object(DD_S3_BUCKET_NAME, self.CACHE_FILENAME)
         try:
-            file_content = cache_object.get()
+            file_content = s3_client.get_object(
+                Bucket=DD_S3_BUCKET_NAME, Key=self.CACHE_FILENAME
+            )
             tags_cache = json.loads(file_content["Body"].read().decode("utf-8"))
             last_modified_unix_time = get_last_modified_time(file_content)
         except:
@@ -186,7 +237,7 @@ class BaseTagsCache(object):
         """Populate the tags in the local cache by getting cache from s3
         If cache not in s3, then cache is built using build_tags_cache
         """
-        self.last_tags_fetch_time = time()
+        self.last_tags_fetch_time = refresh_started_at = time()
 
         # If the custom tag fetch env var is not set to true do not fetch
         if not self.should_fetch_tags():
@@ -204,23 +255,125 @@ class BaseTagsCache(object):
             if lock_acquired:
                 success, new_tags_fetched = self.build_tags_cache()
                 if success:
-                    self.tags_by_id = new_tags_fetched
-                    self.write_cache_to_s3(self.tags_by_id)
+                    self.write_cache_to_s3(new_tags_fetched)
+                    self._set_tags_by_id(new_tags_fetched, refresh_started_at)
                 elif tags_fetched != {}:
-                    self.tags_by_id = tags_fetched
+                    self._set_tags_by_id(tags_fetched, refresh_started_at)
 
                 self.release_s3_cache_lock()
         # s3 cache fetch succeeded and isn't expired
         elif last_modified > -1:
-            self.tags_by_id = tags_fetched
+            self._set_tags_by_id(tags_fetched, refresh_started_at)
+
+    def _set_tags_by_id(self, tags_by_id, refresh_started_at=None):
+        """Swap in the tags of a full refresh, which supersede the tags fetched per key
+
+        The tags fetched per key since `refresh_started_at`, while the refresh
+        was running, are kept as they are at least as recent.
+        """
+        with self._lock:
+            entries = {}
+            if refresh_started_at is not None:
+                entries = {
+                    key: entry
+                    for key, entry in self.entries.items()
+                    if entry.fetched_at >= refresh_started_at
+                }
+            for key in entries:
+                tags_by_id[key] = self.tags_by_id.get(key, [])
+            self.tags_by_id = tags_by_id
+            self.entries = entries
+
+    def should_fetch_entry(self, key):
+        """Returns whether the tags of a key are missing, or were fetched on their
+        own and their TTL has expired"""
+        if key not in self.tags_by_id:
+            return True
+        entry = self.entries.get(key)
+        return entry is not None and entry.is_expired()
+
+    def set_entry(self, key, tags):
+        """Cache the tags fetched for a single key
+
+        The tags are kept for the TTL of their status: found, not found (no
+        tags), or fetch error. The TTL of the errors doubles on each consecutive
+        failure, up to the TTL of the tags found.
+
+        Args:
+            key (str): the key the tags were fetched for
+            tags (str[]): the tags fetched, None if the fetch failed
+        """
+        with self._lock:
+            self._set_entry(key, tags)
+
+    def _set_entry(self, key, tags):
+        now = time()
+        if tags is None:
+            previous_entry = self.entries.get(key)
+            failures = 1
+            if previous_entry is not None and previous_entry.status == TAGS_FETCH_ERROR:
+                failures = previous_entry.failures + 1
+            ttl_seconds = min(
+                self.error_ttl_seconds * 2 ** (failures - 1), self.tags_ttl_seconds
+            )
+            self.entries[key] = TagsCacheEntry(
+                now, TAGS_FETCH_ERROR, ttl_seconds, failures
+            )
+            # Keep serving the tags fetched before the failure, if any
+            self.tags_by_id.setdefault(key, [])
+        elif tags:
+            self.entries[key] = TagsCacheEntry(now, TAGS_FOUND, self.tags_ttl_seconds)
+            self.tags_by_id[key] = tags
+        else:
+            self.entries[key] = TagsCacheEntry(
+                now, TAGS_NOT_FOUND, self.negative_ttl_seconds
+            )
+            self.tags_by_id[key] = tags
+
+    def _refresh_if_expired(self):
+        """Refresh the tags ahead of the expiry of the fetch TTL
+
+        The refresh runs in a background thread while `get` keeps serving the
+        previous tags (stale-while-revalidate), `_refresh` swapping in the new
+        tags dict once it is complete. It starts `refresh_ahead_seconds` before
+        the TTL expires so that the tags served are rarely expired. There are
+        no tags to serve before the first refresh, so it is waited for, but no
+        longer than `get_budget_seconds`.
+
+        Returns:
+            bool: whether a refresh was started
+        """
+        if not self._is_expired(ahead_seconds=self.refresh_ahead_seconds):
+            return False
+
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return False
+
+        is_first_refresh = not self.last_tags_fetch_time
+        # Reset the fetch time right away so that a single refresh is started
+        self.last_tags_fetch_time = time()
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_in_background, daemon=True
+        )
+        self._refresh_thread.start()
+        if is_first_refresh:
+            self._refresh_thread.join(self.get_budget_seconds)
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self._refresh()
+        except Exception:
+            logger.exception("Failed to refresh the tags cache")
 
-    def _is_expired(self, last_modified=None):
-        """Returns bool for whether the fetch TTL has expired"""
+    def _is_expired(self, last_modified=None, ahead_seconds=0):
+        """Returns bool for whether the fetch TTL has expired, or expires in less
+        than `ahead_seconds`"""
         if not last_modified:
             last_modified = self.last_tags_fetch_time
 
         earliest_time_to_refetch_tags = last_modified + self.tags_ttl_seconds
-        return time() > earliest_time_to_refetch_tags
+        return time() > earliest_time_to_refetch_tags - ahead_seconds
 
     def should_fetch_tags(self):
         raise Exception("SHOULD FETCH TAGS MUST BE DEFINED FOR TAGS CACHES")
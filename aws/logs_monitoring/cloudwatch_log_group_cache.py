@@ -1,8 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+import botocore
+from botocore.exceptions import ClientError
 
 from base_tags_cache import (
     BaseTagsCache,
+    get_dd_tag_string_from_aws_dict,
     logger,
+    resource_tagging_client,
     sanitize_aws_tag_string,
     send_forwarder_internal_metrics,
     should_fetch_log_group_tags,
@@ -12,6 +18,11 @@ from settings import (
     DD_S3_LOG_GROUP_CACHE_LOCK_FILENAME,
 )
 
+GET_RESOURCES_LOG_GROUP_FILTER = "logs:log-group"
+
+# Max number of concurrent ListTagsLogGroup calls when GetResources can't be used
+LIST_TAGS_LOG_GROUP_MAX_WORKERS = 5
+
 
 class CloudwatchLogGroupTagsCache(BaseTagsCache):
     CACHE_FILENAME = DD_S3_LOG_GROUP_CACHE_FILENAME
@@ -21,25 +32,53 @@ class CloudwatchLogGroupTagsCache(BaseTagsCache):
         return should_fetch_log_group_tags()
 
     def build_tags_cache(self):
-        """Makes API calls to GetResources to get the live tags of the account's Lambda functions
+        """Makes API calls to GetResources to get the live tags of the account's log groups
 
-        Returns an empty dict instead of fetching custom tags if the tag fetch env variable is not set to true
+        Falls back to concurrent ListTagsLogGroup calls for the known log groups if
+        GetResources fails, e.g. when this Lambda's role can't call it
 
         Returns:
-            tags_by_arn_cache (dict<str, str[]>): each Lambda's tags in a dict keyed by ARN
+            tags_by_log_group_cache (dict<str, str[]>): each log group's tags in a dict keyed by name
         """
-        new_tags = {}
-        for log_group in self.tags_by_id.keys():
-            log_group_tags = get_log_group_tags(log_group)
-            # If we didn't get back log group tags we'll use the locally cached ones if they exist
-            # This avoids losing tags on a failed api call
-            if log_group_tags is None:
-                log_group_tags = self.tags_by_id.get(log_group, [])
-            new_tags[log_group] = log_group_tags
+        # Copy the keys as the tags of new log groups may be added by `get`
+        # while the cache is refreshed in the background
+        known_log_groups = list(self.tags_by_id.keys())
+        try:
+            # GetResources only returns the log groups that are tagged
+            new_tags = {log_group: [] for log_group in known_log_groups}
+            new_tags.update(get_tags_by_log_group())
+        except ClientError as e:
+            logger.exception(
+                "Encountered a ClientError when trying to fetch log group tags. You may need "
+                "to give this Lambda's role the 'tag:GetResources' permission"
+            )
+            additional_tags = [
+                f"http_status_code:{e.response['ResponseMetadata']['HTTPStatusCode']}"
+            ]
+            send_forwarder_internal_metrics(
+                "client_error", additional_tags=additional_tags
+            )
+            new_tags = self.list_tags_of_log_groups(known_log_groups)
 
         logger.debug("All tags in Cloudwatch Log Groups refresh: {}".format(new_tags))
         return True, new_tags
 
+    def list_tags_of_log_groups(self, log_groups):
+        """Gets the tags of the log groups with concurrent ListTagsLogGroup calls"""
+        new_tags = {}
+        with ThreadPoolExecutor(
+            max_workers=LIST_TAGS_LOG_GROUP_MAX_WORKERS
+        ) as executor:
+            for log_group, log_group_tags in zip(
+                log_groups, executor.map(get_log_group_tags, log_groups)
+            ):
+                # If we didn't get back log group tags we'll use the locally cached ones if they exist
+                # This avoids losing tags on a failed api call
+                if log_group_tags is None:
+                    log_group_tags = self.tags_by_id.get(log_group, [])
+                new_tags[log_group] = log_group_tags
+        return new_tags
+
     def get(self, log_group):
         """Get the tags for the Cloudwatch Log Group from the cache
 
@@ -52,13 +91,11 @@ class CloudwatchLogGroupTagsCache(BaseTagsCache):
         Returns:
             log_group_tags (str[]): the list of "key:value" Datadog tag strings
         """
-        if self._is_expired():
+        if self._refresh_if_expired():
             send_forwarder_internal_metrics("local_cache_expired")
-            logger.debug("Local cache expired, fetching cache from S3")
-            self._refresh()
+            logger.debug("Local cache expired, refreshing it from S3")
 
-        log_group_tags = self.tags_by_id.get(log_group, None)
-        if log_group_tags is None:
+        if self.should_fetch_entry(log_group):
             # If the custom tag fetch env var is not set to true do not fetch
             if not self.should_fetch_tags():
                 logger.debug(
@@ -66,10 +103,35 @@ class CloudwatchLogGroupTagsCache(BaseTagsCache):
                     "not set to true"
                 )
                 return []
-            log_group_tags = get_log_group_tags(log_group) or []
-            self.tags_by_id[log_group] = log_group_tags
-
-        return log_group_tags
+            self.set_entry(log_group, get_log_group_tags(log_group))
+
+        return self.tags_by_id.get(log_group, [])
+
+
+def get_tags_by_log_group():
+    """Gets the tags of all the tagged log groups with paginated GetResources calls
+
+    Returns:
+        tags_by_log_group (dict<str, str[]>): the tags of each log group keyed by name
+    """
+    tags_by_log_group = {}
+    get_resources_paginator = resource_tagging_client.get_paginator("get_resources")
+    for page in get_resources_paginator.paginate(
+        ResourceTypeFilters=[GET_RESOURCES_LOG_GROUP_FILTER], ResourcesPerPage=100
+    ):
+        send_forwarder_internal_metrics("log_group_get_resources_api_calls")
+        for resource_tag_mapping in page["ResourceTagMappingList"]:
+            # e.g. arn:aws:logs:us-east-1:123456789012:log-group:/aws/lambda/my-function
+            # The names of the log groups are case sensitive, unlike Lambda ARNs
+            arn = resource_tag_mapping["ResourceARN"]
+            log_group = arn.split(":log-group:", 1)[-1]
+            if log_group.endswith(":*"):
+                log_group = log_group[: -len(":*")]
+            tags_by_log_group[log_group] = [
+                get_dd_tag_string_from_aws_dict(tag)
+                for tag in resource_tag_mapping["Tags"]
+            ]
+    return tags_by_log_group
 
 
 def get_log_group_tags(log_group):
@@ -95,4 +157,7 @@ def get_log_group_tags(log_group):
     return formatted_tags
 
 
-cloudwatch_logs_client = boto3.client("logs")
+# The adaptive retry mode slows down the calls when they get throttled
+cloudwatch_logs_client = boto3.client(
+    "logs", config=botocore.config.Config(retries={"mode": "adaptive"})
+)
@@ -0,0 +1,151 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+import json
+import logging
+import os
+from time import time
+
+from datadog_lambda.metric import lambda_stats
+from telemetry import (
+    DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX,
+    get_forwarder_telemetry_tags,
+)
+from settings import (
+    DD_DEDUP_WINDOW_SECONDS,
+    DD_DEDUP_MAX_EVENT_IDS,
+    DD_DEDUP_SEED_FILE,
+    DD_DEDUP_SEED_FILE_SAVE_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger()
+
+
+class EventIdDeduplicator(object):
+    """Remembers the ids of the events forwarded in the last `window_seconds`, at
+    most `max_ids` of them, for as long as the Lambda container is warm
+
+    The ids seen during an invocation are pending until committed, once the
+    events were forwarded, so that the events of a failed invocation, or of its
+    failed batch items, are not dropped as duplicates when they are redelivered.
+    """
+
+    def __init__(self, window_seconds, max_ids):
+        self.window_seconds = window_seconds
+        self.max_ids = max_ids
+        # Maps an event id to the time it was seen, in insertion order
+        self._seen = {}
+        # Maps an event id to the time it was seen and its batch item id
+        self._pending = {}
+        # Batch item (see DD_BATCH_ITEM_ID) of the events being deduplicated
+        self.item_id = None
+        self._saved = True
+
+    def is_duplicate(self, event_id):
+        now = time()
+        self._expire(now)
+        if event_id in self._seen or event_id in self._pending:
+            return True
+        self._pending[event_id] = (now, self.item_id)
+        return False
+
+    def commit(self, failed_item_ids=()):
+        """Remember the pending ids, but those of the failed batch items"""
+        failed_item_ids = set(failed_item_ids)
+        for event_id, (seen_at, item_id) in self._pending.items():
+            if item_id not in failed_item_ids:
+                self._seen[event_id] = seen_at
+                self._saved = False
+        self.discard()
+        while len(self._seen) > self.max_ids:
+            del self._seen[next(iter(self._seen))]
+
+    def discard(self):
+        self._pending = {}
+        self.item_id = None
+
+    def _expire(self, now):
+        oldest = now - self.window_seconds
+        while self._seen:
+            event_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= oldest:
+                break
+            del self._seen[event_id]
+
+    def load(self, path):
+        """Seed the ids from a file saved by a previous runtime of the container"""
+        try:
+            with open(path) as f:
+                self._seen = dict(json.load(f))
+            self._expire(time())
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug(f"Unable to load the event ids from {path}: {e}")
+
+    def save(self, path):
+        """Save the ids to a file, if ids were committed since the last save"""
+        if self._saved:
+            return
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(list(self._seen.items()), f)
+            os.replace(tmp_path, path)
+            self._saved = True
+        except Exception as e:
+            logger.debug(f"Unable to save the event ids to {path}: {e}")
+
+
+event_id_deduplicator = EventIdDeduplicator(
+    DD_DEDUP_WINDOW_SECONDS, DD_DEDUP_MAX_EVENT_IDS
+)
+if DD_DEDUP_WINDOW_SECONDS > 0 and DD_DEDUP_SEED_FILE:
+    event_id_deduplicator.load(DD_DEDUP_SEED_FILE)
+# Time the ids were last saved to DD_DEDUP_SEED_FILE
+seed_file_saved_at = 0
+
+
+def deduplicate_log_events(log_events):
+    """Yields the log events whose id was not seen in the deduplication window"""
+    duplicates = 0
+    for log in log_events:
+        event_id = log.get("id")
+        if event_id is not None and event_id_deduplicator.is_duplicate(event_id):
+            duplicates += 1
+            continue
+        yield log
+
+    if duplicates:
+        logger.debug(f"Dropped {duplicates} duplicate log events")
+        lambda_stats.distribution(
+            "{}.logs_deduplicated".format(DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX),
+            duplicates,
+            tags=get_forwarder_telemetry_tags(),
+        )
+
+
+def start_deduplication():
+    """Forget the pending ids of a previous invocation that failed"""
+    event_id_deduplicator.discard()
+
+
+def set_deduplication_item_id(item_id):
+    """Set the batch item of the log events deduplicated next"""
+    event_id_deduplicator.item_id = item_id
+
+
+def end_deduplication(failed_item_ids=()):
+    """Remember the ids seen during the invocation, but those of the events of
+    the batch items that failed, which are redelivered"""
+    global seed_file_saved_at
+    event_id_deduplicator.commit(failed_item_ids)
+    now = time()
+    if (
+        DD_DEDUP_SEED_FILE
+        and now - seed_file_saved_at >= DD_DEDUP_SEED_FILE_SAVE_INTERVAL_SECONDS
+    ):
+        event_id_deduplicator.save(DD_DEDUP_SEED_FILE)
+        seed_file_saved_at = now
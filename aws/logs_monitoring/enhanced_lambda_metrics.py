@@ -3,21 +3,39 @@
 # This product includes software developed at Datadog (https://www.datadoghq.com/).
 # Copyright 2021 Datadog, Inc.
 
+import json
 import logging
 import re
 import datetime
 
+from collections import defaultdict
 from time import time
 
 from lambda_cache import LambdaTagsCache
+from metrics_aggregator import metrics_aggregator
+from settings import (
+    DD_ENHANCED_METRICS_ROLLUP,
+    DD_METRICS_AGGREGATION_INTERVAL_SECONDS,
+)
 
 ENHANCED_METRICS_NAMESPACE_PREFIX = "aws.lambda.enhanced"
 
 # Latest Lambda pricing per https://aws.amazon.com/lambda/pricing/
 BASE_LAMBDA_INVOCATION_PRICE = 0.0000002
 LAMBDA_PRICE_PER_GB_SECOND = 0.0000166667
+ARM64_LAMBDA_PRICE_PER_GB_SECOND = 0.0000133334
+
+# Values of the architecture tag of the functions running on Graviton
+ARM64_ARCHITECTURES = ("arm64", "aarch64")
 
 ESTIMATED_COST_METRIC_NAME = "estimated_cost"
+ESTIMATED_COST_FULL_METRIC_NAME = "{}.{}".format(
+    ENHANCED_METRICS_NAMESPACE_PREFIX, ESTIMATED_COST_METRIC_NAME
+)
+# The Datadog Lambda library submits one "invocations" and "cold_starts" point of
+# value 1 per invocation, the counts of the rollups use their own names
+ROLLED_UP_INVOCATIONS_METRIC_NAME = "rolled_up_invocations"
+ROLLED_UP_COLD_STARTS_METRIC_NAME = "rolled_up_cold_starts"
 
 
 # Names to use for metrics and for the named regex groups
@@ -56,6 +74,17 @@ OUT_OF_MEMORY_ERROR_STRINGS = [
     "failed to allocate memory (NoMemoryError)",  # Ruby
 ]
 
+# Matches any of the out of memory error strings in a single scan
+OUT_OF_MEMORY_ERROR_REGEX = re.compile(
+    "|".join(re.escape(s) for s in OUT_OF_MEMORY_ERROR_STRINGS)
+)
+
+# Literals contained in every match of the regexes above, checked before running
+# them as most log lines are neither REPORT, timeout nor out of memory logs
+REPORT_LOG_LITERAL = "REPORT"
+TIMED_OUT_LITERAL = "timed"
+OUT_OF_MEMORY_LITERAL = "emory"
+
 METRICS_TO_PARSE_FROM_REPORT = [
     DURATION_METRIC_NAME,
     BILLED_DURATION_METRIC_NAME,
@@ -63,6 +92,26 @@ METRICS_TO_PARSE_FROM_REPORT = [
     INIT_DURATION_METRIC_NAME,
 ]
 
+# Types of the records of the Lambda platform logs in JSON format, see
+# https://docs.aws.amazon.com/lambda/latest/dg/telemetry-schema-reference.html
+PLATFORM_REPORT_TYPE = "platform.report"
+PLATFORM_INIT_REPORT_TYPE = "platform.initReport"
+PLATFORM_RUNTIME_DONE_TYPE = "platform.runtimeDone"
+PLATFORM_RECORD_TYPES = (
+    PLATFORM_REPORT_TYPE,
+    PLATFORM_INIT_REPORT_TYPE,
+    PLATFORM_RUNTIME_DONE_TYPE,
+)
+
+# Keys of the REPORT metrics in the metrics of the platform.report records
+PLATFORM_REPORT_METRIC_KEYS = {
+    DURATION_METRIC_NAME: "durationMs",
+    BILLED_DURATION_METRIC_NAME: "billedDurationMs",
+    MAX_MEMORY_USED_METRIC_NAME: "maxMemoryUsedMB",
+    INIT_DURATION_METRIC_NAME: "initDurationMs",
+}
+PLATFORM_MEMORY_SIZE_KEY = "memorySizeMB"
+
 # Multiply the duration metrics by 1/1000 to convert ms to seconds
 METRIC_ADJUSTMENT_FACTORS = {
     DURATION_METRIC_NAME: 0.001,
@@ -98,10 +147,12 @@ class DatadogMetricPoint(object):
 
     """
 
-    def __init__(self, name, value, timestamp=None, tags=[]):
+    __slots__ = ("name", "value", "timestamp", "tags")
+
+    def __init__(self, name, value, timestamp=None, tags=()):
         self.name = name
         self.value = value
-        self.tags = tags
+        self.tags = list(tags)
         self.timestamp = timestamp
 
     def add_tags(self, tags):
@@ -110,7 +161,7 @@ class DatadogMetricPoint(object):
         Args:
             tags (str[]): list of tags to add to this metric
         """
-        self.tags = self.tags + tags
+        self.tags.extend(tags)
 
     def set_timestamp(self, timestamp):
         """Set the metric's timestamp
@@ -120,18 +171,55 @@ class DatadogMetricPoint(object):
         """
         self.timestamp = timestamp
 
-    def submit_to_dd(self):
-        """Submit this metric to the Datadog API"""
-        timestamp = self.timestamp
-        if not timestamp:
-            timestamp = time()
 
-        logger.debug(
-            "Submitting metric {} {} {}".format(self.name, self.value, self.tags)
-        )
-        lambda_stats.distribution(
-            self.name, self.value, timestamp=timestamp, tags=self.tags
-        )
+class EnhancedMetricsRollup(object):
+    """Rolls up the estimated cost of the invocations of each function per time bucket
+
+    The estimated cost points, one per REPORT log, are summed per tags and
+    time bucket, and submitted along with the number of invocations and cold
+    starts they were generated from. The other enhanced metrics, e.g. the
+    durations, keep all their values to preserve their percentiles.
+    """
+
+    def __init__(self, interval=DD_METRICS_AGGREGATION_INTERVAL_SECONDS):
+        self.interval = max(int(interval), 1)
+        # (tags, timestamp bucket) -> [invocations, estimated cost]
+        self._rollups = defaultdict(lambda: [0, 0.0])
+
+    def add(self, metric):
+        """Rolls up the metric if it is an estimated cost, returns whether it was"""
+        if metric.name != ESTIMATED_COST_FULL_METRIC_NAME:
+            return False
+        timestamp = int(metric.timestamp if metric.timestamp else time())
+        bucket = timestamp - timestamp % self.interval
+        rollup = self._rollups[(tuple(sorted(metric.tags)), bucket)]
+        rollup[0] += 1
+        rollup[1] += metric.value
+        return True
+
+    def submit(self, aggregator):
+        """Adds the rolled up metrics to the metrics aggregator and resets them"""
+        for (tags, bucket), (invocations, estimated_cost) in self._rollups.items():
+            aggregator.add(
+                ESTIMATED_COST_FULL_METRIC_NAME,
+                estimated_cost,
+                timestamp=bucket,
+                tags=tags,
+            )
+            aggregator.add(
+                f"{ENHANCED_METRICS_NAMESPACE_PREFIX}.{ROLLED_UP_INVOCATIONS_METRIC_NAME}",
+                invocations,
+                timestamp=bucket,
+                tags=tags,
+            )
+            if "cold_start:true" in tags:
+                aggregator.add(
+                    f"{ENHANCED_METRICS_NAMESPACE_PREFIX}.{ROLLED_UP_COLD_STARTS_METRIC_NAME}",
+                    invocations,
+                    timestamp=bucket,
+                    tags=tags,
+                )
+        self._rollups.clear()
 
 
 def get_last_modified_time(s3_file):
@@ -144,7 +232,8 @@ def get_last_modified_time(s3_file):
 
 
 def parse_and_submit_enhanced_metrics(logs):
-    """Parses enhanced metrics from logs and submits them to DD with tags
+    """Parses enhanced metrics from logs and adds them with tags to the metrics
+    aggregator, which submits them to DD in bulk
 
     Args:
         logs (dict<str, str | dict | int>[]): the logs parsed from the event in the split method
@@ -154,21 +243,36 @@ def parse_and_submit_enhanced_metrics(logs):
     if not DD_SUBMIT_ENHANCED_METRICS:
         return
 
+    # The tags of each function are resolved once for all of its logs
+    tags_by_arn = {}
+    rollup = EnhancedMetricsRollup() if DD_ENHANCED_METRICS_ROLLUP else None
     for log in logs:
         try:
             enhanced_metrics = generate_enhanced_lambda_metrics(
-                log, account_lambda_custom_tags_cache
+                log, account_lambda_custom_tags_cache, tags_by_arn
             )
             for enhanced_metric in enhanced_metrics:
-                enhanced_metric.submit_to_dd()
+                # The timestamps of the logs are in milliseconds
+                enhanced_metric.set_timestamp(enhanced_metric.timestamp // 1000)
+                if rollup is not None and rollup.add(enhanced_metric):
+                    continue
+                metrics_aggregator.add(
+                    enhanced_metric.name,
+                    enhanced_metric.value,
+                    timestamp=enhanced_metric.timestamp,
+                    tags=enhanced_metric.tags,
+                )
         except Exception:
             logger.exception(
                 "Encountered an error while trying to parse and submit enhanced metrics for log %s",
                 log,
             )
 
+    if rollup is not None:
+        rollup.submit(metrics_aggregator)
+
 
-def generate_enhanced_lambda_metrics(log, tags_cache):
+def generate_enhanced_lambda_metrics(log, tags_cache, tags_by_arn=None):
     """Parses a Lambda log for enhanced Lambda metrics and tags
 
     Args:
@@ -196,6 +300,8 @@ def generate_enhanced_lambda_metrics(log, tags_cache):
                     "host": "arn:aws:lambda:us-east-1:172597598159:function:function_log_generator"
                 }
         tags_cache (LambdaTagsCache): used to apply the Lambda's custom tags to the metrics
+        tags_by_arn (dict<str, str[]>): optional, the tags already resolved for each
+            function ARN, updated with the tags resolved for this log
 
     Returns:
         DatadogMetricPoint[], where each metric has all of its tags
@@ -209,27 +315,42 @@ def generate_enhanced_lambda_metrics(log, tags_cache):
     if not is_lambda_log:
         return []
 
-    # Check if this is a REPORT log
-    parsed_metrics = parse_metrics_from_report_log(log_message)
-
-    # Check if this is a timeout
-    if not parsed_metrics:
-        parsed_metrics = create_timeout_enhanced_metric(log_message)
-
-    # Check if this is an out of memory error
-    if not parsed_metrics:
-        parsed_metrics = create_out_of_memory_enhanced_metric(log_message)
+    # Check if this is a platform record of a function logging in JSON format
+    platform_record = parse_platform_log_record(log_message)
+    if platform_record is not None:
+        parsed_metrics = parse_metrics_from_platform_record(platform_record)
+    elif isinstance(log_message, str):
+        # Check if this is a REPORT log
+        parsed_metrics = parse_metrics_from_report_log(log_message)
+
+        # Check if this is a timeout
+        if not parsed_metrics:
+            parsed_metrics = create_timeout_enhanced_metric(log_message)
+
+        # Check if this is an out of memory error
+        if not parsed_metrics:
+            parsed_metrics = create_out_of_memory_enhanced_metric(log_message)
+    else:
+        parsed_metrics = []
 
     # If none of the above, move on
     if not parsed_metrics:
         return []
 
     # Add the tags from ARN, custom tags cache, and env var
-    tags_from_arn = parse_lambda_tags_from_arn(log_function_arn)
-    lambda_custom_tags = tags_cache.get(log_function_arn)
+    function_tags = tags_by_arn.get(log_function_arn) if tags_by_arn else None
+    if function_tags is None:
+        tags_from_arn = parse_lambda_tags_from_arn(log_function_arn)
+        function_tags = tags_from_arn + tags_cache.get(log_function_arn)
+        if tags_by_arn is not None:
+            tags_by_arn[log_function_arn] = function_tags
+
+    # The estimated costs are computed with the x86 pricing until the tags are known
+    if get_architecture_from_tags(function_tags) in ARM64_ARCHITECTURES:
+        set_arm64_estimated_cost(parsed_metrics)
 
     for parsed_metric in parsed_metrics:
-        parsed_metric.add_tags(tags_from_arn + lambda_custom_tags)
+        parsed_metric.add_tags(function_tags)
         # Submit the metric with the timestamp of the log event
         parsed_metric.set_timestamp(int(timestamp))
 
@@ -273,26 +394,135 @@ def parse_metrics_from_report_log(report_log_line):
     Returns:
         metrics - DatadogMetricPoint[]
     """
+    if REPORT_LOG_LITERAL not in report_log_line:
+        return []
 
     regex_match = REPORT_LOG_REGEX.search(report_log_line)
 
     if not regex_match:
         return []
 
+    return create_report_metrics(
+        {
+            metric_name: regex_match.group(metric_name)
+            for metric_name in METRICS_TO_PARSE_FROM_REPORT
+        },
+        regex_match.group(MEMORY_ALLOCATED_FIELD_NAME),
+    )
+
+
+def parse_platform_log_record(log_message):
+    """Returns the platform record of a Lambda log in JSON format, or None
+
+    Args:
+        log_message (str | dict): the message of the log
+        EX: '{"time": "2023-11-14T22:01:05.000Z", "type": "platform.report", "record": {
+                "requestId": "8edab1f8-7d34-4a8e-a965-15ccbbb78d4c", "status": "success",
+                "metrics": {"durationMs": 0.62, "billedDurationMs": 100, "memorySizeMB": 128,
+                "maxMemoryUsedMB": 51}}}'
+    """
+    if isinstance(log_message, str):
+        # Only decode the messages that can be platform records
+        if not log_message.startswith("{") or '"platform.' not in log_message:
+            return None
+        try:
+            log_message = json.loads(log_message)
+        except ValueError:
+            return None
+
+    if not isinstance(log_message, dict):
+        return None
+    if log_message.get("type") not in PLATFORM_RECORD_TYPES:
+        return None
+    if not isinstance(log_message.get("record"), dict):
+        return None
+    return log_message
+
+
+def parse_metrics_from_platform_record(platform_record):
+    """Parses and returns metrics from a Lambda platform record
+
+    The platform.report records hold the same metrics as the REPORT logs, the
+    timeouts are read from the status of the platform.runtimeDone records. The
+    init duration of on-demand initializations is reported by platform.report,
+    so platform.initReport only adds it for the other initialization types
+    (e.g. provisioned-concurrency).
+
+    Args:
+        platform_record (dict): a record returned by parse_platform_log_record
+
+    Returns:
+        metrics - DatadogMetricPoint[]
+    """
+    record_type = platform_record["type"]
+    record = platform_record["record"]
+    metrics = record.get("metrics")
+    if not isinstance(metrics, dict):
+        metrics = {}
+
+    if record_type == PLATFORM_REPORT_TYPE:
+        memory_size = metrics.get(PLATFORM_MEMORY_SIZE_KEY)
+        if memory_size is None or metrics.get("billedDurationMs") is None:
+            return []
+        return create_report_metrics(
+            {
+                metric_name: metrics.get(key)
+                for metric_name, key in PLATFORM_REPORT_METRIC_KEYS.items()
+            },
+            memory_size,
+        )
+
+    if record_type == PLATFORM_RUNTIME_DONE_TYPE:
+        if record.get("status") != "timeout":
+            return []
+        return [
+            DatadogMetricPoint(
+                f"{ENHANCED_METRICS_NAMESPACE_PREFIX}.{TIMEOUTS_METRIC_NAME}",
+                1.0,
+            )
+        ]
+
+    # platform.initReport
+    init_duration = metrics.get("durationMs")
+    if init_duration is None or record.get("initializationType") == "on-demand":
+        return []
+    return [
+        DatadogMetricPoint(
+            f"{ENHANCED_METRICS_NAMESPACE_PREFIX}.{INIT_DURATION_METRIC_NAME}",
+            float(init_duration) * METRIC_ADJUSTMENT_FACTORS[INIT_DURATION_METRIC_NAME],
+            tags=[
+                "init_type:{}".format(record.get("initializationType")),
+                "status:{}".format(record.get("status")),
+            ],
+        )
+    ]
+
+
+def create_report_metrics(report_values, memory_size):
+    """Returns the metrics of a REPORT log, with the memory size and cold start tags
+
+    Args:
+        report_values (dict<str, str | float>): the value of each of the
+            METRICS_TO_PARSE_FROM_REPORT, in ms and MB, or None when not reported
+        memory_size (str | int): the memory allocated to the function, in MB
+
+    Returns:
+        metrics - DatadogMetricPoint[]
+    """
     metrics = []
 
-    tags = ["memorysize:" + regex_match.group(MEMORY_ALLOCATED_FIELD_NAME)]
-    if regex_match.group(INIT_DURATION_METRIC_NAME):
+    tags = ["memorysize:{}".format(memory_size)]
+    if report_values.get(INIT_DURATION_METRIC_NAME) is not None:
         tags.append("cold_start:true")
     else:
         tags.append("cold_start:false")
 
     for metric_name in METRICS_TO_PARSE_FROM_REPORT:
         # check whether the metric, e.g., init duration, is present in the REPORT log
-        if not regex_match.group(metric_name):
+        if report_values.get(metric_name) is None:
             continue
 
-        metric_point_value = float(regex_match.group(metric_name))
+        metric_point_value = float(report_values[metric_name])
         # Multiply the duration metrics by 1/1000 to convert ms to seconds
         if metric_name in METRIC_ADJUSTMENT_FACTORS:
             metric_point_value *= METRIC_ADJUSTMENT_FACTORS[metric_name]
@@ -307,10 +537,10 @@ def parse_metrics_from_report_log(report_log_line):
         metrics.append(dd_metric)
 
     estimated_cost_metric_point = DatadogMetricPoint(
-        "{}.{}".format(ENHANCED_METRICS_NAMESPACE_PREFIX, ESTIMATED_COST_METRIC_NAME),
+        ESTIMATED_COST_FULL_METRIC_NAME,
         calculate_estimated_cost(
-            float(regex_match.group(BILLED_DURATION_METRIC_NAME)),
-            float(regex_match.group(MEMORY_ALLOCATED_FIELD_NAME)),
+            float(report_values[BILLED_DURATION_METRIC_NAME]),
+            float(memory_size),
         ),
     )
 
@@ -321,19 +551,56 @@ def parse_metrics_from_report_log(report_log_line):
     return metrics
 
 
-def calculate_estimated_cost(billed_duration_ms, memory_allocated):
+def calculate_estimated_cost(billed_duration_ms, memory_allocated, architecture=None):
     """Returns the estimated cost in USD of a Lambda invocation
 
     Args:
         billed_duration (float | int): number of milliseconds this invocation is billed for
         memory_allocated (float | int): amount of memory in MB allocated to the function execution
+        architecture (str): the architecture of the function, x86 if None
 
     See https://aws.amazon.com/lambda/pricing/ for latest pricing
     """
     # Divide milliseconds by 1000 to get seconds
     gb_seconds = (billed_duration_ms / 1000.0) * (memory_allocated / 1024.0)
 
-    return BASE_LAMBDA_INVOCATION_PRICE + gb_seconds * LAMBDA_PRICE_PER_GB_SECOND
+    price_per_gb_second = LAMBDA_PRICE_PER_GB_SECOND
+    if architecture in ARM64_ARCHITECTURES:
+        price_per_gb_second = ARM64_LAMBDA_PRICE_PER_GB_SECOND
+
+    return BASE_LAMBDA_INVOCATION_PRICE + gb_seconds * price_per_gb_second
+
+
+def get_architecture_from_tags(tags):
+    """Returns the value of the architecture tag of a function, or None"""
+    for tag in tags:
+        if tag.startswith("architecture:"):
+            return tag[len("architecture:") :]
+    return None
+
+
+def set_arm64_estimated_cost(metrics):
+    """Recomputes the estimated cost of the metrics of a REPORT log with the arm64
+    pricing, from their billed duration and memory size
+
+    Args:
+        metrics (DatadogMetricPoint[]): the metrics generated from a log
+    """
+    billed_duration_ms = None
+    for metric in metrics:
+        if metric.name.endswith("." + BILLED_DURATION_METRIC_NAME):
+            billed_duration_ms = metric.value * 1000
+    for metric in metrics:
+        if metric.name != ESTIMATED_COST_FULL_METRIC_NAME or billed_duration_ms is None:
+            continue
+        memory_size = next(
+            tag[len("memorysize:") :]
+            for tag in metric.tags
+            if tag.startswith("memorysize:")
+        )
+        metric.value = calculate_estimated_cost(
+            billed_duration_ms, float(memory_size), architecture="arm64"
+        )
 
 
 def get_enriched_lambda_log_tags(log_event):
@@ -366,6 +633,8 @@ def create_timeout_enhanced_metric(log_line):
     Returns:
         DatadogMetricPoint[]
     """
+    if TIMED_OUT_LITERAL not in log_line:
+        return []
 
     regex_match = TIMED_OUT_REGEX.search(log_line)
     if not regex_match:
@@ -387,12 +656,10 @@ def create_out_of_memory_enhanced_metric(log_line):
     Returns:
         DatadogMetricPoint[]
     """
+    if OUT_OF_MEMORY_LITERAL not in log_line:
+        return []
 
-    contains_out_of_memory_error = any(
-        s in log_line for s in OUT_OF_MEMORY_ERROR_STRINGS
-    )
-
-    if not contains_out_of_memory_error:
+    if not OUT_OF_MEMORY_ERROR_REGEX.search(log_line):
         return []
 
     dd_metric = DatadogMetricPoint(
@@ -80,9 +80,8 @@ class LambdaTagsCache(BaseTagsCache):
             )
             return []
 
-        if self._is_expired():
+        if self._refresh_if_expired():
             send_forwarder_internal_metrics("local_cache_expired")
-            logger.debug("Local cache expired, fetching cache from S3")
-            self._refresh()
+            logger.debug("Local cache expired, refreshing it from S3")
 
         return self.tags_by_id.get(key, [])
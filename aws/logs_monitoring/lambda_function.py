@@ -23,7 +23,13 @@ from enhanced_lambda_metrics import (
     parse_and_submit_enhanced_metrics,
 )
 from logs import forward_logs
+from sampling import sample_logs
+from log_metrics import submit_log_metrics
+from metrics_aggregator import metrics_aggregator
+from dedup import start_deduplication, end_deduplication
 from parsing import (
+    LogEvent,
+    decode_json_message,
     parse,
     separate_security_hub_findings,
     parse_aws_waf_logs,
@@ -44,6 +50,8 @@ from settings import (
     DD_HOST,
     DD_FORWARDER_VERSION,
     DD_ADDITIONAL_TARGET_LAMBDAS,
+    DD_REPORT_BATCH_ITEM_FAILURES,
+    DD_DEDUP_WINDOW_SECONDS,
 )
 
 
@@ -89,10 +97,21 @@ def datadog_forwarder(event, context):
     if DD_ADDITIONAL_TARGET_LAMBDAS:
         invoke_additional_target_lambdas(event)
 
-    metrics, logs, trace_payloads = split(transform(enrich(parse(event, context))))
+    if DD_DEDUP_WINDOW_SECONDS > 0:
+        start_deduplication()
+
+    failed_item_ids = [] if DD_REPORT_BATCH_ITEM_FAILURES else None
+    metrics, logs, trace_payloads = split(
+        transform(enrich(parse(event, context, failed_item_ids)))
+    )
+
+    submit_log_metrics(logs)
 
     if DD_FORWARD_LOG:
-        forward_logs(logs)
+        # Enhanced metrics are still computed from all the logs below
+        failed_logs_item_ids = forward_logs(sample_logs(logs))
+        if failed_item_ids is not None:
+            failed_item_ids.extend(failed_logs_item_ids)
 
     forward_metrics(metrics)
 
@@ -101,6 +120,14 @@ def datadog_forwarder(event, context):
 
     parse_and_submit_enhanced_metrics(logs)
 
+    metrics_aggregator.flush()
+
+    if DD_DEDUP_WINDOW_SECONDS > 0:
+        end_deduplication(failed_item_ids or ())
+
+    if failed_item_ids is not None:
+        return build_batch_item_failures_response(failed_item_ids)
+
 
 lambda_handler = datadog_lambda_wrapper(datadog_forwarder)
 
@@ -125,12 +152,34 @@ def invoke_additional_target_lambdas(event):
     return
 
 
+def build_batch_item_failures_response(failed_item_ids):
+    """Build the partial batch response listing the batch items to retry
+    See https://docs.aws.amazon.com/lambda/latest/dg/with-kinesis.html#services-kinesis-batchfailurereporting
+    """
+    # Dedup the identifiers while keeping their order
+    failed_item_ids = list(dict.fromkeys(failed_item_ids))
+    if failed_item_ids:
+        logger.warning(f"Reporting {len(failed_item_ids)} failed batch items")
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": item_id} for item_id in failed_item_ids
+        ]
+    }
+
+
 def split(events):
     """Split events into metrics, logs, and trace payloads"""
     metrics, logs, trace_payloads = [], [], []
     for event in events:
-        metric = extract_metric(event)
-        trace_payload = extract_trace_payload(event)
+        # Metrics and traces are logged as JSON objects, only decode the messages
+        # that look like one, and only once for both extractors
+        json_message = load_json_message(event)
+        if json_message is None:
+            logs.append(event)
+            continue
+        metric = extract_metric(event, json_message)
+        trace_payload = extract_trace_payload(event, json_message)
         if metric:
             metrics.append(metric)
         elif trace_payload:
@@ -146,10 +195,26 @@ def split(events):
     return metrics, logs, trace_payloads
 
 
-def extract_metric(event):
-    """Extract metric from an event if possible"""
+def load_json_message(event):
+    """Returns the JSON object logged as the message of an event, or None
+
+    The message of a CloudWatch log event is decoded only once, for all the
+    steps looking for its JSON object.
+    """
+    if isinstance(event, LogEvent):
+        return event.get_json_message()
+    return decode_json_message(event.get("message"))
+
+
+def extract_metric(event, json_message=None):
+    """Extract metric from an event if possible
+
+    json_message is the already decoded JSON object of the message, if any
+    """
     try:
-        metric = json.loads(event["message"])
+        if json_message is None:
+            json_message = json.loads(event["message"])
+        metric = json_message
         required_attrs = {"m", "v", "e", "t"}
         if not all(attr in metric for attr in required_attrs):
             return None
@@ -170,11 +235,14 @@ def extract_metric(event):
         return None
 
 
-def extract_trace_payload(event):
-    """Extract trace payload from an event if possible"""
+def extract_trace_payload(event, json_message=None):
+    """Extract trace payload from an event if possible
+
+    json_message is the already decoded JSON object of the message, if any
+    """
     try:
         message = event["message"]
-        obj = json.loads(event["message"])
+        obj = json_message if json_message is not None else json.loads(message)
 
         obj_has_traces = "traces" in obj
         traces_is_a_list = isinstance(obj["traces"], list)
@@ -319,7 +387,7 @@ def extract_ddtags_from_message(event):
             extracted_ddtags = event["message"].pop(DD_CUSTOM_TAGS)
         if isinstance(event["message"], str):
             try:
-                message_dict = json.loads(event["message"])
+                message_dict = load_json_message(event)
                 extracted_ddtags = message_dict.pop(DD_CUSTOM_TAGS)
                 event["message"] = json.dumps(message_dict)
             except Exception:
@@ -356,9 +424,8 @@ def extract_host_from_cloudtrails(event):
     if event is not None and event.get(DD_SOURCE) == "cloudtrail":
         message = event.get("message", {})
         if isinstance(message, str):
-            try:
-                message = json.loads(message)
-            except json.JSONDecodeError:
+            message = load_json_message(event)
+            if message is None:
                 logger.debug("Failed to decode cloudtrail message")
                 return
 
@@ -387,9 +454,8 @@ def extract_host_from_route53(event):
     if event is not None and event.get(DD_SOURCE) == "route53":
         message = event.get("message", {})
         if isinstance(message, str):
-            try:
-                message = json.loads(message)
-            except json.JSONDecodeError:
+            message = load_json_message(event)
+            if message is None:
                 logger.debug("Failed to decode Route53 message")
                 return
 
@@ -401,15 +467,16 @@ def extract_host_from_route53(event):
 
 def forward_metrics(metrics):
     """
-    Forward custom metrics submitted via logs to Datadog in a background thread
-    using `lambda_stats` that is provided by the Datadog Python Lambda Layer.
+    Forward custom metrics submitted via logs to Datadog, aggregated per name,
+    tags and time bucket by the metrics aggregator.
     """
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Forwarding {len(metrics)} metrics")
 
+    # The metrics are aggregated and submitted in bulk at the end of the invocation
     for metric in metrics:
         try:
-            lambda_stats.distribution(
+            metrics_aggregator.add(
                 metric["m"], metric["v"], timestamp=metric["e"], tags=metric["t"]
             )
         except Exception:
@@ -0,0 +1,141 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+import json
+import logging
+import re
+from time import time
+
+from metrics_aggregator import metrics_aggregator
+from settings import (
+    DD_SOURCE,
+    DD_LOG_METRIC_RULES,
+)
+
+logger = logging.getLogger()
+
+COUNT_METRIC_TYPE = "count"
+DISTRIBUTION_METRIC_TYPE = "distribution"
+
+
+class LogMetricRule(object):
+    """Generates a metric from the logs of a source matching a pattern
+
+    The fields used as value and tags are read from the named groups of the
+    pattern, or from the keys of the message when it is a dict (e.g. parsed
+    columns). Count metrics count the matching logs, distribution metrics
+    collect the values of the `value` field of the matching logs.
+    """
+
+    def __init__(
+        self,
+        name,
+        type=COUNT_METRIC_TYPE,
+        source=None,
+        pattern=None,
+        value=None,
+        tag_fields=(),
+        tags=(),
+    ):
+        if type not in (COUNT_METRIC_TYPE, DISTRIBUTION_METRIC_TYPE):
+            raise ValueError(f"Unknown metric type {type}")
+        if type == DISTRIBUTION_METRIC_TYPE and value is None:
+            raise ValueError("The value field of distribution metrics is required")
+        self.name = name
+        self.type = type
+        self.source = source
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.value = value
+        self.tag_fields = list(tag_fields)
+        self.tags = list(tags)
+
+    def get_fields(self, log):
+        """Returns the fields of a log matching the rule, or None"""
+        if self.source is not None and log.get(DD_SOURCE) != self.source:
+            return None
+        message = log.get("message")
+        if isinstance(message, dict):
+            if self.pattern is not None:
+                return None
+            return message
+        if not isinstance(message, str):
+            return None
+        if self.pattern is None:
+            return {}
+        match = self.pattern.search(message)
+        return match.groupdict() if match else None
+
+    def get_point(self, log):
+        """Returns the (value, tags) of the metric point generated by a log, or None"""
+        fields = self.get_fields(log)
+        if fields is None:
+            return None
+        if self.type == COUNT_METRIC_TYPE:
+            value = 1
+        else:
+            try:
+                value = float(fields[self.value])
+            except (KeyError, TypeError, ValueError):
+                return None
+        tags = self.tags + [
+            f"{field}:{fields[field]}"
+            for field in self.tag_fields
+            if fields.get(field) is not None
+        ]
+        return value, tuple(sorted(tags))
+
+
+def parse_log_metric_rules(config):
+    """Parse the DD_LOG_METRIC_RULES config, a JSON list of the LogMetricRule
+    arguments, e.g. [{"name": "alb.requests", "source": "elb",
+    "pattern": "^\\\\S+ \\\\S+ (?P<elb>\\\\S+)", "tag_fields": ["elb"]}]
+    """
+    if config is None:
+        return []
+    try:
+        return [LogMetricRule(**rule) for rule in json.loads(config)]
+    except Exception:
+        raise Exception("could not parse DD_LOG_METRIC_RULES: {}".format(config))
+
+
+log_metric_rules = parse_log_metric_rules(DD_LOG_METRIC_RULES)
+
+
+def get_log_timestamp(log):
+    """Returns the timestamp of a log in seconds, or None if it has none"""
+    timestamp = log.get("timestamp")
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        # The timestamps of the CloudWatch log events are in milliseconds
+        return timestamp / 1000
+    return None
+
+
+def submit_log_metrics(logs, rules=None):
+    """Generates the metrics of the log metric rules and adds them to the metrics
+    aggregator, in the time bucket of each log
+
+    Count rules generate count metrics, summed per time bucket, rather than one
+    point per log.
+    """
+    if rules is None:
+        rules = log_metric_rules
+    if not rules:
+        return
+
+    for log in logs:
+        timestamp = None
+        for rule in rules:
+            point = rule.get_point(log)
+            if point is None:
+                continue
+            if timestamp is None:
+                timestamp = get_log_timestamp(log) or time()
+            value, tags = point
+            if rule.type == COUNT_METRIC_TYPE:
+                metrics_aggregator.add_count(
+                    rule.name, value, timestamp=timestamp, tags=tags
+                )
+            else:
+                metrics_aggregator.add(rule.name, value, timestamp=timestamp, tags=tags)
@@ -7,6 +7,7 @@ from settings import DD_FORWARDER_VERSION
 import gzip
 import json
 import os
+from collections import defaultdict
 from concurrent.futures import as_completed
 
 import re
@@ -34,6 +35,9 @@ from settings import (
     INCLUDE_AT_MATCH,
     EXCLUDE_AT_MATCH,
     DD_MAX_WORKERS,
+    DD_BATCH_ITEM_ID,
+    DD_SOURCE,
+    DD_LOG_FIELD_PROJECTION,
 )
 
 logger = logging.getLogger()
@@ -48,14 +52,44 @@ class ScrubbingException(Exception):
 
 
 def forward_logs(logs):
-    """Forward logs to Datadog"""
+    """Forward logs to Datadog
+
+    Returns the batch item identifiers (see DD_BATCH_ITEM_ID) of the logs
+    that could not be forwarded
+    """
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Forwarding {len(logs)} logs")
+    # The filters match the logs before their projection, so that the fields it
+    # drops or renames are still matched. Without filters, the logs are projected
+    # before being serialized, only once.
+    filtered = INCLUDE_AT_MATCH is not None or EXCLUDE_AT_MATCH is not None
+    serialized_logs = []
+    projected_logs = {}
+    item_ids_by_log = defaultdict(set)
+    for log in logs:
+        item_id = log.pop(DD_BATCH_ITEM_ID, None)
+        projection = log_field_projections.get(
+            log.get(DD_SOURCE), log_field_projections.get("*")
+        )
+        if projection and not filtered:
+            log = project_log_fields(log, projection)
+        serialized_log = json.dumps(log, ensure_ascii=False)
+        if projection and filtered:
+            projected_logs[serialized_log] = (log, projection)
+        if item_id is not None:
+            item_ids_by_log[serialized_log].add(item_id)
+        serialized_logs.append(serialized_log)
+
     logs_to_forward = filter_logs(
-        [json.dumps(log, ensure_ascii=False) for log in logs],
+        serialized_logs,
         include_pattern=INCLUDE_AT_MATCH,
         exclude_pattern=EXCLUDE_AT_MATCH,
     )
+    if projected_logs:
+        logs_to_forward = [
+            project_serialized_log(log, projected_logs, item_ids_by_log)
+            for log in logs_to_forward
+        ]
     scrubber = DatadogScrubber(SCRUBBING_RULE_CONFIGS)
     if DD_USE_TCP:
         batcher = DatadogBatcher(256 * 1000, 256 * 1000, 1)
@@ -66,15 +100,18 @@ def forward_logs(logs):
             DD_URL, DD_PORT, DD_NO_SSL, DD_SKIP_SSL_VALIDATION, DD_API_KEY, scrubber
         )
 
+    failed_logs = []
     with DatadogClient(cli) as client:
         for batch in batcher.batch(logs_to_forward):
             try:
                 client.send(batch)
             except Exception:
                 logger.exception(f"Exception while forwarding log batch {batch}")
+                failed_logs.extend(batch)
             else:
                 if logger.isEnabledFor(logging.DEBUG):
                     logger.debug(f"Forwarded log batch: {json.dumps(batch)}")
+    failed_logs.extend(cli.failed_logs)
 
     lambda_stats.distribution(
         "{}.logs_forwarded".format(DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX),
@@ -82,6 +119,73 @@ def forward_logs(logs):
         tags=get_forwarder_telemetry_tags(),
     )
 
+    failed_item_ids = set()
+    for log in failed_logs:
+        failed_item_ids.update(item_ids_by_log.get(log, ()))
+    return failed_item_ids
+
+
+def project_serialized_log(serialized_log, projected_logs, item_ids_by_log):
+    """Returns a serialized log with its fields projected, if it has a projection"""
+    if serialized_log not in projected_logs:
+        return serialized_log
+    log, projection = projected_logs[serialized_log]
+    projected_log = json.dumps(project_log_fields(log, projection), ensure_ascii=False)
+    item_ids_by_log[projected_log].update(item_ids_by_log.get(serialized_log, ()))
+    return projected_log
+
+
+def parse_log_field_projections(config):
+    """Parse the DD_LOG_FIELD_PROJECTION config into the list of (action, path,
+    new path) to apply to the logs of each source, paths as tuples of keys
+    """
+    if config is None:
+        return {}
+    try:
+        projections = {}
+        for source, projection in json.loads(config).items():
+            projections[source] = [
+                ("rename", tuple(path.split(".")), tuple(new_path.split(".")))
+                for path, new_path in projection.get("rename", {}).items()
+            ] + [
+                ("drop", tuple(path.split(".")), None)
+                for path in projection.get("drop", [])
+            ]
+        return projections
+    except Exception:
+        raise Exception("could not parse DD_LOG_FIELD_PROJECTION: {}".format(config))
+
+
+def project_log_fields(log, projection):
+    """Returns a copy of the log with the fields of the projection dropped or renamed
+
+    The log itself is left untouched: only the dicts along the projected paths are
+    copied, the rest of the log is shared with the copy.
+    """
+    log = dict(log)
+    for action, path, new_path in projection:
+        parent = log
+        for key in path[:-1]:
+            if not isinstance(parent.get(key), dict):
+                break
+            parent[key] = dict(parent[key])
+            parent = parent[key]
+        else:
+            if path[-1] not in parent:
+                continue
+            value = parent.pop(path[-1])
+            if action == "rename":
+                parent = log
+                for key in new_path[:-1]:
+                    child = parent.get(key)
+                    parent[key] = dict(child) if isinstance(child, dict) else {}
+                    parent = parent[key]
+                parent[new_path[-1]] = value
+    return log
+
+
+log_field_projections = parse_log_field_projections(DD_LOG_FIELD_PROJECTION)
+
 
 def compileRegex(rule, pattern):
     if pattern is not None:
@@ -253,6 +357,8 @@ class DatadogTCPClient(object):
         self._api_key = api_key
         self._scrubber = scrubber
         self._sock = None
+        # Sends are synchronous, failures are raised by send
+        self.failed_logs = []
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 f"Initialized tcp client for logs intake: "
@@ -322,7 +428,9 @@ class DatadogHTTPClient(object):
         self._timeout = timeout
         self._session = None
         self._ssl_validation = not skip_ssl_validation
-        self._futures = []
+        self._futures = {}
+        # Logs of the batches whose asynchronous send failed
+        self.failed_logs = []
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 f"Initialized http client for logs intake: "
@@ -338,9 +446,18 @@ class DatadogHTTPClient(object):
         # Resolve all the futures and log exceptions if any
         for future in as_completed(self._futures):
             try:
-                future.result()
+                response = future.result()
             except Exception:
                 logger.exception("Exception while forwarding logs")
+                self.failed_logs.extend(self._futures[future])
+                continue
+            # requests doesn't raise on HTTP errors, the batch was rejected
+            if not 200 <= response.status_code < 300:
+                logger.error(
+                    f"Failed to forward logs, intake responded with status code "
+                    f"{response.status_code}"
+                )
+                self.failed_logs.extend(self._futures[future])
 
         self._session.close()
 
@@ -359,7 +476,7 @@ class DatadogHTTPClient(object):
         future = self._session.post(
             self._url, data, timeout=self._timeout, verify=self._ssl_validation
         )
-        self._futures.append(future)
+        self._futures[future] = logs
 
     def __enter__(self):
         self._connect()
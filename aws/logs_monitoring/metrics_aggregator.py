@@ -0,0 +1,118 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+import logging
+from collections import defaultdict
+from time import time
+
+from datadog import api
+from datadog_lambda.metric import lambda_stats
+from settings import DD_METRICS_AGGREGATION_INTERVAL_SECONDS
+from telemetry import (
+    DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX,
+    get_forwarder_telemetry_tags,
+)
+
+logger = logging.getLogger()
+
+# Max number of series submitted per API call
+MAX_SERIES_PER_REQUEST = 1000
+# Number of attempts to submit a batch of series
+MAX_SUBMIT_ATTEMPTS = 2
+
+
+class MetricsAggregator(object):
+    """Aggregates distribution and count points to submit them in bulk
+
+    The values of the points are grouped by metric name, tag set and time
+    bucket of `interval` seconds. As distributions are submitted as lists of
+    values, the aggregation doesn't lose any value, it only saves submitting
+    each point on its own. The counts are summed per time bucket.
+
+    The metrics are submitted to the API directly rather than through
+    lambda_stats, which only submits distributions, one point per call, while
+    the log metric rules generate counts as well.
+    """
+
+    def __init__(self, interval=DD_METRICS_AGGREGATION_INTERVAL_SECONDS):
+        self.interval = max(int(interval), 1)
+        # (name, tags) -> timestamp bucket -> values
+        self._series = defaultdict(lambda: defaultdict(list))
+        # (name, tags) -> timestamp bucket -> count
+        self._counts = defaultdict(lambda: defaultdict(int))
+
+    def __len__(self):
+        return len(self._series) + len(self._counts)
+
+    def get_bucket(self, timestamp):
+        timestamp = int(timestamp if timestamp else time())
+        return timestamp - timestamp % self.interval
+
+    def add(self, name, value, timestamp=None, tags=()):
+        bucket = self.get_bucket(timestamp)
+        self._series[(name, tuple(sorted(tags)))][bucket].append(value)
+
+    def add_count(self, name, value=1, timestamp=None, tags=()):
+        bucket = self.get_bucket(timestamp)
+        self._counts[(name, tuple(sorted(tags)))][bucket] += value
+
+    def get_distributions(self):
+        return [
+            {
+                "metric": name,
+                "points": [(bucket, values) for bucket, values in buckets.items()],
+                "tags": list(tags),
+            }
+            for (name, tags), buckets in self._series.items()
+        ]
+
+    def get_counts(self):
+        return [
+            {
+                "metric": name,
+                "points": list(buckets.items()),
+                "type": "count",
+                "interval": self.interval,
+                "tags": list(tags),
+            }
+            for (name, tags), buckets in self._counts.items()
+        ]
+
+    def flush(self):
+        """Submit the aggregated metrics to the Datadog API and reset them"""
+        distributions = self.get_distributions()
+        counts = self.get_counts()
+        self._series.clear()
+        self._counts.clear()
+        for i in range(0, len(distributions), MAX_SERIES_PER_REQUEST):
+            batch = distributions[i : i + MAX_SERIES_PER_REQUEST]
+            submit_series(lambda: api.Distribution.send(distributions=batch), batch)
+        for i in range(0, len(counts), MAX_SERIES_PER_REQUEST):
+            batch = counts[i : i + MAX_SERIES_PER_REQUEST]
+            submit_series(lambda: api.Metric.send(metrics=batch), batch)
+
+
+def submit_series(send, batch):
+    """Calls send to submit a batch of series, retrying once, and counts the
+    series that could not be submitted"""
+    for attempt in range(1, MAX_SUBMIT_ATTEMPTS + 1):
+        try:
+            send()
+            return
+        except Exception:
+            logger.exception(
+                f"Exception while submitting {len(batch)} metrics (attempt {attempt})"
+            )
+    lambda_stats.distribution(
+        "{}.metrics_submission_failures".format(
+            DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX
+        ),
+        len(batch),
+        tags=get_forwarder_telemetry_tags(),
+    )
+
+
+# Shared by the metrics generated during an invocation, flushed at its end
+metrics_aggregator = MetricsAggregator()
@@ -4,10 +4,12 @@
 # Copyright 2021 Datadog, Inc.
 
 import base64
+import codecs
 import gzip
 import json
 import os
 import copy
+import functools
 
 import boto3
 import botocore
@@ -15,7 +17,10 @@ import itertools
 import re
 import urllib
 import logging
-from io import BytesIO, BufferedReader
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
 from datadog_lambda.metric import lambda_stats
 
@@ -25,6 +30,7 @@ from customized_log_group import (
 )
 from step_functions_cache import StepFunctionsTagsCache
 from cloudwatch_log_group_cache import CloudwatchLogGroupTagsCache
+from dedup import deduplicate_log_events, set_deduplication_item_id
 from telemetry import (
     DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX,
     get_forwarder_telemetry_tags,
@@ -33,12 +39,24 @@ from telemetry import (
 from settings import (
     DD_TAGS,
     DD_MULTILINE_LOG_REGEX_PATTERN,
+    DD_MULTILINE_LOG_MAX_RECORD_SIZE,
+    DD_PARSE_S3_LOG_COLUMNS,
+    DD_DEDUP_WINDOW_SECONDS,
+    DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN,
+    DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES,
+    DD_CLOUDWATCH_MULTILINE_LOG_MAX_SIZE,
     DD_SOURCE,
     DD_CUSTOM_TAGS,
     DD_SERVICE,
     DD_HOST,
     DD_FORWARDER_VERSION,
     DD_USE_VPC,
+    DD_KINESIS_DECODE_WORKERS,
+    DD_BATCH_ITEM_ID,
+    DD_S3_FETCH_WORKERS,
+    DD_S3_FETCH_MAX_PENDING_SIZE,
+    DD_S3_RANGED_GET_THRESHOLD,
+    DD_S3_RANGED_GET_PART_SIZE,
 )
 
 GOV, CN = "gov", "cn"
@@ -47,8 +65,8 @@ logger = logging.getLogger()
 
 if DD_MULTILINE_LOG_REGEX_PATTERN:
     try:
-        multiline_regex = re.compile(
-            "[\n\r\f]+(?={})".format(DD_MULTILINE_LOG_REGEX_PATTERN)
+        multiline_regex_start_pattern = re.compile(
+            "^{}".format(DD_MULTILINE_LOG_REGEX_PATTERN)
         )
     except Exception:
         raise Exception(
@@ -56,9 +74,27 @@ if DD_MULTILINE_LOG_REGEX_PATTERN:
                 DD_MULTILINE_LOG_REGEX_PATTERN
             )
         )
-    multiline_regex_start_pattern = re.compile(
-        "^{}".format(DD_MULTILINE_LOG_REGEX_PATTERN)
-    )
+
+if DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN:
+    try:
+        cloudwatch_multiline_regex_start_pattern = re.compile(
+            "^{}".format(DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN)
+        )
+    except Exception:
+        raise Exception(
+            "could not compile cloudwatch multiline regex with pattern: {}".format(
+                DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN
+            )
+        )
+
+# Lines logged by the Lambda platform, in text or JSON format, never merged with
+# other lines
+lambda_platform_log_regex = re.compile(
+    '^(START|END|REPORT|INIT_START) |^{.*"type": ?"platform\\.'
+)
+
+# Messages that may be a JSON object
+json_object_start_regex = re.compile(r"\s*\{")
 
 rds_regex = re.compile("/aws/rds/(instance|cluster)/(?P<host>[^/]+)/(?P<name>[^/]+)")
 
@@ -67,14 +103,23 @@ cloudtrail_regex = re.compile(
     re.I,
 )
 
+# Created on first use and reused as long as the log forwarder Lambda container is running
+s3_client = None
+
 # Store the cache in the global scope so that it will be reused as long as
 # the log forwarder Lambda container is running
 account_cw_logs_tags_cache = CloudwatchLogGroupTagsCache()
 account_step_functions_tags_cache = StepFunctionsTagsCache()
 
 
-def parse(event, context):
-    """Parse Lambda input to normalized events"""
+def parse(event, context, failed_item_ids=None):
+    """Parse Lambda input to normalized events
+
+    When a failed_item_ids list is given, the records of a Kinesis or SQS batch
+    that cannot be parsed are skipped and their identifiers appended to the list,
+    instead of failing the whole batch. Events are then tagged with the
+    identifier of the record they come from (see DD_BATCH_ITEM_ID).
+    """
     metadata = generate_metadata(context)
     event_type = "unknown"
     try:
@@ -91,7 +136,9 @@ def parse(event, context):
         elif event_type == "sns":
             events = sns_handler(event, metadata)
         elif event_type == "kinesis":
-            events = kinesis_awslogs_handler(event, context, metadata)
+            events = kinesis_awslogs_handler(event, context, metadata, failed_item_ids)
+        elif event_type == "sqs":
+            events = sqs_handler(event, context, metadata, failed_item_ids)
     except Exception as e:
         # Logs through the socket the error
         err_message = "Error parsing the object. Exception: {} for event {}".format(
@@ -152,6 +199,8 @@ def parse_event_type(event):
             return "sns"
         elif "kinesis" in event["Records"][0]:
             return "kinesis"
+        elif event["Records"][0].get("eventSource") == "aws:sqs":
+            return "sqs"
 
     elif "awslogs" in event:
         return "awslogs"
@@ -163,25 +212,35 @@ def parse_event_type(event):
 
 # Handle S3 events
 def s3_handler(event, context, metadata):
-    # Need to use path style to access s3 via VPC Endpoints
-    # https://github.com/gford1000-aws/lambda_s3_access_using_vpc_endpoint#boto3-specific-notes
-    if DD_USE_VPC:
-        s3 = boto3.client(
-            "s3",
-            os.environ["AWS_REGION"],
-            config=botocore.config.Config(s3={"addressing_style": "path"}),
-        )
-    else:
-        s3 = boto3.client("s3")
-    # if this is a S3 event carried in a SNS message, extract it and override the event
-    if "Sns" in event["Records"][0]:
-        event = json.loads(event["Records"][0]["Sns"]["Message"])
+    """Parse the objects referenced by all the records of an S3 event notification
 
-    # Get the object from the event and show its content type
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(event["Records"][0]["s3"]["object"]["key"])
+    The objects are fetched concurrently, at most DD_S3_FETCH_WORKERS or
+    DD_S3_FETCH_MAX_PENDING_SIZE bytes ahead of the parsing, and parsed in the
+    order of the records.
+    """
+    s3_objects = []
+    for record in event["Records"]:
+        # if this is a S3 event carried in a SNS message, extract it
+        if "Sns" in record:
+            s3_objects.extend(get_s3_objects(json.loads(record["Sns"]["Message"])))
+        elif "s3" in record:
+            s3_objects.extend(get_s3_objects({"Records": [record]}))
+
+    base_metadata = copy.deepcopy(metadata)
+    fetched_objects = map_concurrently(
+        get_s3_object_data,
+        s3_objects,
+        min(DD_S3_FETCH_WORKERS, len(s3_objects)),
+        DD_S3_FETCH_MAX_PENDING_SIZE,
+        get_s3_object_size,
+    )
+    for (bucket, key, _), fetched_object in zip(s3_objects, fetched_objects):
+        reset_metadata(metadata, base_metadata)
+        yield from s3_object_handler(fetched_object(), bucket, key, context, metadata)
 
-    source = parse_event_source(event, key)
+
+def s3_object_handler(data, bucket, key, context, metadata):
+    source = find_s3_source(key)
     if "transit-gateway" in bucket:
         source = "transitgateway"
     metadata[DD_SOURCE] = source
@@ -193,26 +252,182 @@ def s3_handler(event, context, metadata):
     if hostname:
         metadata[DD_HOST] = hostname
 
-    # Extract the S3 object
-    response = s3.get_object(Bucket=bucket, Key=key)
-    body = response["Body"]
-    data = body.read()
-
     yield from get_structured_lines_for_s3_handler(data, bucket, key, source)
 
 
+def get_s3_client():
+    """Returns the S3 client shared by the invocations of this container
+
+    boto3 clients are thread safe, its connection pool is sized to serve
+    DD_S3_FETCH_WORKERS concurrent object fetches, plus as many ranged requests
+    of the large object being read meanwhile
+    """
+    global s3_client
+    if s3_client is None:
+        config = botocore.config.Config(max_pool_connections=2 * DD_S3_FETCH_WORKERS)
+        # Need to use path style to access s3 via VPC Endpoints
+        # https://github.com/gford1000-aws/lambda_s3_access_using_vpc_endpoint#boto3-specific-notes
+        if DD_USE_VPC:
+            s3_client = boto3.client(
+                "s3",
+                os.environ["AWS_REGION"],
+                config=config.merge(
+                    botocore.config.Config(s3={"addressing_style": "path"})
+                ),
+            )
+        else:
+            s3_client = boto3.client("s3", config=config)
+    return s3_client
+
+
+def get_s3_object_data(s3_object):
+    """Returns the content of a (bucket, key, size) S3 object
+
+    Uncompressed objects larger than DD_S3_RANGED_GET_THRESHOLD are returned as
+    an iterator of byte chunks, lazily fetched as concurrent ranged requests,
+    since a single stream is too slow to read them before the Lambda times out.
+    """
+    bucket, key, size = s3_object
+    if is_fetched_as_ranges(s3_object):
+        return get_s3_object_ranges(bucket, key, size)
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    return response["Body"].read()
+
+
+def is_fetched_as_ranges(s3_object):
+    _, key, size = s3_object
+    return (
+        DD_S3_RANGED_GET_THRESHOLD > 0
+        and size is not None
+        and size > DD_S3_RANGED_GET_THRESHOLD
+        and not key.endswith(".gz")
+    )
+
+
+def get_s3_object_ranges(bucket, key, size):
+    """Yields the content of an S3 object in order, fetched as concurrent byte ranges
+
+    The ranges following the first one are only fetched if the object still has
+    the ETag of the first range, so that the ranges of different versions of an
+    object overwritten meanwhile are never mixed.
+    """
+
+    def get_range(start, **kwargs):
+        end = min(start + DD_S3_RANGED_GET_PART_SIZE, size) - 1
+        return get_s3_client().get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", **kwargs
+        )
+
+    first_range = get_range(0)
+    etag = first_range["ETag"]
+    yield first_range["Body"].read()
+
+    for fetched_range in map_concurrently(
+        lambda start: get_range(start, IfMatch=etag)["Body"].read(),
+        range(DD_S3_RANGED_GET_PART_SIZE, size, DD_S3_RANGED_GET_PART_SIZE),
+        DD_S3_FETCH_WORKERS,
+    ):
+        yield fetched_range()
+
+
+def get_s3_objects(s3_notification):
+    """Returns the (bucket, key, size) S3 objects referenced by an S3 event notification"""
+    return [
+        (
+            record["s3"]["bucket"]["name"],
+            urllib.parse.unquote_plus(record["s3"]["object"]["key"]),
+            record["s3"]["object"].get("size"),
+        )
+        for record in s3_notification.get("Records", [])
+        if "s3" in record
+    ]
+
+
+def split_lines(chunks, separator=None):
+    """Decode and split into lines a text received as an iterable of byte chunks
+
+    Lines are split like str.splitlines, or on the given separator in which case
+    empty lines are dropped. A line spanning several chunks is only yielded once
+    its end is received.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        if separator:
+            lines = pending.split(separator)
+            pending = lines.pop()
+            yield from (line for line in lines if line != "")
+        else:
+            # The last line is kept pending, even if complete, as it may be
+            # continued by the next chunk, or its \r followed by a \n
+            lines = pending.splitlines(keepends=True)
+            pending = lines.pop() if lines else ""
+            for line in lines:
+                yield line[:-2] if line.endswith("\r\n") else line[:-1]
+
+    pending += decoder.decode(b"", final=True)
+    if separator:
+        yield from (line for line in pending.split(separator) if line != "")
+    else:
+        yield from pending.splitlines()
+
+
 def get_structured_lines_for_s3_handler(data, bucket, key, source):
+    if not isinstance(data, bytes):
+        # The object is received as chunks, split its lines as they are received
+        # unless it has to be parsed as a whole
+        chunks = iter(data)
+        first_chunk = next(chunks, b"")
+        chunks = itertools.chain([first_chunk], chunks)
+        if first_chunk[:2] != b"\x1f\x8b" and not is_cloudtrail(str(key)):
+            for line in split_s3_object_lines(chunks, source):
+                yield {"aws": {"s3": {"bucket": bucket, "key": key}}, "message": line}
+            return
+        data = b"".join(chunks)
+
     # Decompress data that has a .gz extension or magic header http://www.onicos.com/staff/iz/formats/gzip.html
-    if key[-3:] == ".gz" or data[:2] == b"\x1f\x8b":
-        with gzip.GzipFile(fileobj=BytesIO(data)) as decompress_stream:
-            # Reading line by line avoid a bug where gzip would take a very long time (>5min) for
-            # file around 60MB gzipped
-            data = b"".join(BufferedReader(decompress_stream))
+    is_gzipped = key[-3:] == ".gz" or data[:2] == b"\x1f\x8b"
+
+    if is_cloudtrail(str(key)):
+        # Parse the records of CloudTrail log files as they are decompressed,
+        # the largest ones don't fit in memory once fully parsed. Files that
+        # don't start with the Records array are parsed as a whole below.
+        has_records = False
+        try:
+            for event in iter_cloudtrail_records(
+                iter_decompressed_chunks(data, is_gzipped)
+            ):
+                has_records = True
+                # Create structured object and send it
+                yield merge_dicts(
+                    event, {"aws": {"s3": {"bucket": bucket, "key": key}}}
+                )
+        except Exception as e:
+            if not has_records:
+                logger.debug("Unable to parse cloudtrail log: %s" % e)
+            else:
+                # The records parsed so far were forwarded, the rest is lost
+                logger.error(
+                    f"Unable to parse the CloudTrail log file s3://{bucket}/{key} "
+                    f"past its first records: {e}"
+                )
+                lambda_stats.distribution(
+                    "{}.cloudtrail_parse_failures".format(
+                        DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX
+                    ),
+                    1,
+                    tags=get_forwarder_telemetry_tags(),
+                )
+        if has_records:
+            return
 
     is_cloudtrail_bucket = False
     if is_cloudtrail(str(key)):
         try:
-            cloud_trail = json.loads(data)
+            cloud_trail = json.loads(
+                b"".join(iter_decompressed_chunks(data, is_gzipped))
+            )
             if cloud_trail.get("Records") is not None:
                 # only parse as a cloudtrail bucket if we have a Records field to parse
                 is_cloudtrail_bucket = True
@@ -226,24 +441,10 @@ def get_structured_lines_for_s3_handler(data, bucket, key, source):
             logger.debug("Unable to parse cloudtrail log: %s" % e)
 
     if not is_cloudtrail_bucket:
-        # Check if using multiline log regex pattern
-        # and determine whether line or pattern separated logs
-        data = data.decode("utf-8", errors="ignore")
-        if DD_MULTILINE_LOG_REGEX_PATTERN and multiline_regex_start_pattern.match(data):
-            split_data = multiline_regex.split(data)
-        else:
-            if DD_MULTILINE_LOG_REGEX_PATTERN:
-                logger.debug(
-                    "DD_MULTILINE_LOG_REGEX_PATTERN %s did not match start of file, splitting by line",
-                    DD_MULTILINE_LOG_REGEX_PATTERN,
-                )
-            if source == "waf":
-                # WAF logs are \n separated
-                split_data = [d for d in data.split("\n") if d != ""]
-            else:
-                split_data = data.splitlines()
-
-        # Send lines to Datadog
+        # Send lines to Datadog, as they are decompressed
+        split_data = split_s3_object_lines(
+            iter_decompressed_chunks(data, is_gzipped), source
+        )
         for line in split_data:
             # Create structured object and send it
             structured_line = {
@@ -253,6 +454,262 @@ def get_structured_lines_for_s3_handler(data, bucket, key, source):
             yield structured_line
 
 
+def split_s3_object_lines(chunks, source):
+    """Yields the logs of an S3 object received as byte chunks, one per line, or one
+    per multiline record if the object starts with DD_MULTILINE_LOG_REGEX_PATTERN
+    """
+    if DD_MULTILINE_LOG_REGEX_PATTERN:
+        chunks = iter(chunks)
+        first_chunk = next(chunks, b"")
+        chunks = itertools.chain([first_chunk], chunks)
+        if multiline_regex_start_pattern.match(
+            first_chunk.decode("utf-8", errors="ignore")
+        ):
+            yield from split_multiline_records(chunks)
+            return
+        logger.debug(
+            "DD_MULTILINE_LOG_REGEX_PATTERN %s did not match start of file, splitting by line",
+            DD_MULTILINE_LOG_REGEX_PATTERN,
+        )
+
+    # WAF logs are \n separated
+    lines = split_lines(chunks, "\n" if source == "waf" else None)
+    if DD_PARSE_S3_LOG_COLUMNS and source in s3_log_columns_parsers:
+        lines = s3_log_columns_parsers[source](lines)
+    yield from lines
+
+
+# Columns of the ELB access logs, which have no header
+# https://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
+alb_log_columns = [
+    "type",
+    "time",
+    "elb",
+    "client:port",
+    "target:port",
+    "request_processing_time",
+    "target_processing_time",
+    "response_processing_time",
+    "elb_status_code",
+    "target_status_code",
+    "received_bytes",
+    "sent_bytes",
+    "request",
+    "user_agent",
+    "ssl_cipher",
+    "ssl_protocol",
+    "target_group_arn",
+    "trace_id",
+    "domain_name",
+    "chosen_cert_arn",
+    "matched_rule_priority",
+    "request_creation_time",
+    "actions_executed",
+    "redirect_url",
+    "error_reason",
+    "target:port_list",
+    "target_status_code_list",
+    "classification",
+    "classification_reason",
+    "conn_trace_id",
+]
+alb_log_types = {"http", "https", "h2", "grpcs", "ws", "wss"}
+classic_elb_log_columns = [
+    "time",
+    "elb",
+    "client:port",
+    "backend:port",
+    "request_processing_time",
+    "backend_processing_time",
+    "response_processing_time",
+    "elb_status_code",
+    "backend_status_code",
+    "received_bytes",
+    "sent_bytes",
+    "request",
+    "user_agent",
+    "ssl_cipher",
+    "ssl_protocol",
+]
+# A double quoted value, which may contain spaces, or a bare value
+elb_log_value_regex = re.compile(r'"([^"]*)"|(\S+)')
+vpc_log_header_regex = re.compile(r"[a-z]+(-[a-z0-9]+)*( [a-z]+(-[a-z0-9]+)*)*$")
+
+
+def get_log_columns(names, values):
+    """Returns the dict of the values of a log line named after its columns,
+    without the values that are missing ("-")
+    """
+    return {name: value for name, value in zip(names, values) if value != "-"}
+
+
+def parse_elb_log_columns(lines):
+    """Yields the lines of ELB access logs as the dicts of their columns"""
+    for line in lines:
+        values = [
+            match.group(2) if match.group(1) is None else match.group(1)
+            for match in elb_log_value_regex.finditer(line)
+        ]
+        if not values:
+            yield line
+        elif values[0] in alb_log_types:
+            yield get_log_columns(alb_log_columns, values)
+        elif len(values) == len(classic_elb_log_columns):
+            yield get_log_columns(classic_elb_log_columns, values)
+        else:
+            # e.g. Network Load Balancer logs
+            yield line
+
+
+def parse_cloudfront_log_columns(lines):
+    """Yields the lines of CloudFront standard logs as the dicts of their columns,
+    named after the #Fields header line. Header lines are dropped.
+    """
+    names = None
+    for line in lines:
+        if line.startswith("#"):
+            if line.startswith("#Fields:"):
+                names = line[len("#Fields:") :].split()
+            continue
+        yield line if names is None else get_log_columns(names, line.split("\t"))
+
+
+def parse_vpc_log_columns(lines):
+    """Yields the lines of VPC flow logs as the dicts of their columns, named after
+    the header line of the log file, which depends on the flow log format
+    """
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        return
+    if not vpc_log_header_regex.match(header):
+        yield header
+        yield from lines
+        return
+
+    names = header.split(" ")
+    for line in lines:
+        yield get_log_columns(names, line.split(" "))
+
+
+s3_log_columns_parsers = {
+    "elb": parse_elb_log_columns,
+    "cloudfront": parse_cloudfront_log_columns,
+    "vpc": parse_vpc_log_columns,
+}
+
+
+# A line followed by its line breaks
+multiline_line_regex = re.compile("[^\n\r\f]*[\n\r\f]*")
+
+
+def split_multiline_records(chunks, max_record_size=None):
+    """Yields the records of a text received as byte chunks, each record starting
+    with a line matching DD_MULTILINE_LOG_REGEX_PATTERN
+
+    The line breaks preceding the start of a record are removed. Only the record
+    being assembled is buffered, and records are cut once they exceed
+    DD_MULTILINE_LOG_MAX_RECORD_SIZE characters, splitting the lines that are
+    longer than that on their own.
+    """
+    if max_record_size is None:
+        max_record_size = DD_MULTILINE_LOG_MAX_RECORD_SIZE
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""
+    record, record_size, line_breaks_size = [], 0, 0
+
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            pending += decoder.decode(b"", final=True)
+        else:
+            pending += decoder.decode(chunk)
+        pos = 0
+        while pos < len(pending):
+            line = multiline_line_regex.match(pending, pos).group()
+            if len(line.rstrip("\n\r\f")) > max_record_size:
+                # Lines longer than a record are cut, rather than buffered whole
+                line = line[:max_record_size]
+            elif chunk is not None and pos + len(line) == len(pending):
+                # The last line, or its line breaks, may continue in the next chunk
+                break
+            pos += len(line)
+            if record and (
+                multiline_regex_start_pattern.match(line)
+                or record_size + len(line) > max_record_size
+            ):
+                yield "".join(record)[: record_size - line_breaks_size]
+                record, record_size = [], 0
+            record.append(line)
+            record_size += len(line)
+            line_breaks_size = len(line) - len(line.rstrip("\n\r\f"))
+        pending = pending[pos:]
+
+    if record:
+        yield "".join(record)
+
+
+def iter_decompressed_chunks(data, is_gzipped, chunk_size=1024**2):
+    """Yields the content of an S3 object by chunks, decompressed if gzipped"""
+    if not is_gzipped:
+        for i in range(0, len(data), chunk_size):
+            yield data[i : i + chunk_size]
+        return
+
+    with gzip.GzipFile(fileobj=BytesIO(data)) as decompress_stream:
+        while chunk := decompress_stream.read(chunk_size):
+            yield chunk
+
+
+cloudtrail_records_start_regex = re.compile(r'\s*\{\s*"Records"\s*:\s*\[\s*')
+cloudtrail_records_separator_regex = re.compile(r"\s*,?\s*")
+
+
+def iter_cloudtrail_records(chunks):
+    """Yields the records of a CloudTrail log file as its chunks are parsed
+
+    Only the files starting with the Records array are parsed, nothing is
+    yielded for other files. Only the record being parsed is held in memory.
+    """
+    chunks = iter(chunks)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+
+    def read_chunk():
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        return True
+
+    while len(buffer) < 1024 and read_chunk():
+        pass
+    match = cloudtrail_records_start_regex.match(buffer)
+    if not match:
+        return
+    pos = match.end()
+
+    while True:
+        pos = cloudtrail_records_separator_regex.match(buffer, pos).end()
+        if pos == len(buffer):
+            if not read_chunk():
+                raise ValueError("Unterminated CloudTrail Records array")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            record, end = json_decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The record continues in the next chunk
+            if not read_chunk():
+                raise
+            continue
+        pos = end
+        yield record
+
+
 def get_service_from_tags_and_remove_duplicates(metadata):
     service = ""
     tagsplit = metadata[DD_CUSTOM_TAGS].split(",")
@@ -276,24 +733,22 @@ def parse_event_source(event, key):
         event (dict): The AWS-formatted log event that the forwarder was triggered with
         key (string): The S3 object key if the event is from S3 or the CW Log Group if the event is from CW Logs
     """
-    lowercase_key = str(key).lower()
-
     # Determines if the key matches any known sources for Cloudwatch logs
     if "awslogs" in event:
-        return find_cloudwatch_source(lowercase_key)
+        return find_cloudwatch_source(key)
 
     # Determines if the key matches any known sources for S3 logs
     if "Records" in event and len(event["Records"]) > 0:
         if "s3" in event["Records"][0]:
-            if is_cloudtrail(str(key)):
-                return "cloudtrail"
-
-            return find_s3_source(lowercase_key)
+            return find_s3_source(key)
 
     return "aws"
 
 
 def find_cloudwatch_source(log_group):
+    """Returns the source of the logs of a CloudWatch log group"""
+    log_group = str(log_group).lower()
+
     # e.g. /aws/rds/instance/my-mariadb/error
     if log_group.startswith("/aws/rds"):
         for engine in ["mariadb", "mysql", "postgresql"]:
@@ -366,6 +821,11 @@ def is_cloudtrail(key):
 
 
 def find_s3_source(key):
+    """Returns the source of the logs of an S3 object"""
+    if is_cloudtrail(str(key)):
+        return "cloudtrail"
+    key = str(key).lower()
+
     # e.g. AWSLogs/123456779121/elasticloadbalancing/us-east-1/2020/10/02/123456779121_elasticloadbalancing_us-east-1_app.alb.xxxxx.xx.xxx.xxx_x.log.gz
     if "elasticloadbalancing" in key:
         return "elb"
@@ -499,14 +959,32 @@ def parse_service_arn(source, key, bucket, context):
 # Handle CloudWatch logs
 def awslogs_handler(event, context, metadata):
     # Get logs
-    with gzip.GzipFile(
-        fileobj=BytesIO(base64.b64decode(event["awslogs"]["data"]))
-    ) as decompress_stream:
-        # Reading line by line avoid a bug where gzip would take a very long
-        # time (>5min) for file around 60MB gzipped
-        data = b"".join(BufferedReader(decompress_stream))
-    logs = json.loads(data)
+    logs = decode_awslogs_data(event["awslogs"]["data"])
+
+    yield from process_awslogs(logs, context, metadata)
+
 
+def decode_awslogs_data(data):
+    """Decode the base64 encoded and gzipped payload of a CloudWatch Logs subscription
+
+    The payload is decompressed with zlib in a single call per gzip member,
+    rather than read through file objects, to limit the copies of the payload.
+    """
+    compressed = base64.b64decode(data)
+    decompressed = []
+    while compressed:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressed.append(decompressor.decompress(compressed))
+        if not decompressor.eof:
+            raise EOFError(
+                "Compressed file ended before the end-of-stream marker was reached"
+            )
+        # Like gzip, skip the zero padding that may follow a member
+        compressed = decompressor.unused_data.lstrip(b"\x00")
+    return json.loads(b"".join(decompressed))
+
+
+def process_awslogs(logs, context, metadata):
     # Set the source on the logs
     source = logs.get("logGroup", "cloudwatch")
 
@@ -518,7 +996,7 @@ def awslogs_handler(event, context, metadata):
         source = "transitgateway"
     if logs["logStream"] == "aws/bedrock/modelinvocations":
         source = "bedrock"
-    metadata[DD_SOURCE] = parse_event_source(event, source)
+    metadata[DD_SOURCE] = find_cloudwatch_source(source)
 
     # Special handling for customized log group of Lambda functions
     # Multiple Lambda functions can share one single customized log group
@@ -566,17 +1044,9 @@ def awslogs_handler(event, context, metadata):
     if metadata[DD_SOURCE] == "stepfunction" and logs["logStream"].startswith(
         "states/"
     ):
-        state_machine_arn = ""
-        try:
-            state_machine_arn = get_state_machine_arn(
-                json.loads(logs["logEvents"][0]["message"])
-            )
-            if state_machine_arn:  # not empty
-                metadata[DD_HOST] = state_machine_arn
-        except Exception as e:
-            logger.debug(
-                "Unable to set stepfunction host or get state_machine_arn: %s" % e
-            )
+        state_machine_arn = get_state_machine_arn_from_awslogs(logs)
+        if state_machine_arn:  # not empty
+            metadata[DD_HOST] = state_machine_arn
 
         formatted_stepfunctions_tags = account_step_functions_tags_cache.get(
             state_machine_arn
@@ -621,9 +1091,90 @@ def awslogs_handler(event, context, metadata):
             metadata[DD_SOURCE] = "aws-iam-authenticator"
         # In case the conditions above don't match we maintain eks as the source
 
+    log_events = logs["logEvents"]
+    if DD_DEDUP_WINDOW_SECONDS > 0:
+        log_events = deduplicate_log_events(log_events)
+    if DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN:
+        log_events = merge_multiline_log_events(log_events)
+
     # Create and send structured logs to Datadog
-    for log in logs["logEvents"]:
-        yield merge_dicts(log, aws_attributes)
+    for log in log_events:
+        yield merge_dicts(LogEvent(log), aws_attributes)
+
+
+class LogEvent(dict):
+    """A log event of a CloudWatch Logs subscription
+
+    The JSON object its message may contain is only decoded when first requested
+    with get_json_message, then reused by the next requests as long as the
+    message is not replaced.
+    """
+
+    __slots__ = ("_decoded_message", "_json_message")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._decoded_message = None
+        self._json_message = None
+
+    def get_json_message(self):
+        """Returns the JSON object logged as the message, or None"""
+        message = self.get("message")
+        if message is not self._decoded_message:
+            self._json_message = decode_json_message(message)
+            self._decoded_message = message
+        return self._json_message
+
+
+def decode_json_message(message):
+    """Returns the JSON object of a message, or None if it does not contain one"""
+    if not isinstance(message, str) or not json_object_start_regex.match(message):
+        return None
+    try:
+        json_message = json.loads(message)
+    except Exception:
+        return None
+    return json_message if isinstance(json_message, dict) else None
+
+
+def merge_multiline_log_events(log_events):
+    """Merge the log events of a log stream that continue a multiline log (e.g. the
+    lines of a stack trace) into the log event of its first line
+
+    A log event starts a new log when it matches
+    DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN, when it is logged by the Lambda
+    platform, or when the current log reached its max number of lines or size.
+    """
+    first_event, lines, size = None, [], 0
+
+    def merged_event():
+        if len(lines) > 1:
+            first_event["message"] = "\n".join(line.rstrip("\r\n") for line in lines)
+        return first_event
+
+    for log in log_events:
+        message = log.get("message", "")
+        is_platform_log = lambda_platform_log_regex.match(message)
+        if (
+            first_event is not None
+            and not is_platform_log
+            and not cloudwatch_multiline_regex_start_pattern.match(message)
+            and len(lines) < DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES
+            and size + len(message) <= DD_CLOUDWATCH_MULTILINE_LOG_MAX_SIZE
+        ):
+            lines.append(message)
+            size += len(message)
+            continue
+
+        if first_event is not None:
+            yield merged_event()
+        first_event, lines, size = log, [message], len(message)
+        if is_platform_log:
+            yield first_event
+            first_event = None
+
+    if first_event is not None:
+        yield merged_event()
 
 
 def merge_dicts(a, b, path=None):
@@ -834,15 +1385,240 @@ def sns_handler(event, metadata):
         yield structured_line
 
 
-# Handle CloudWatch logs from Kinesis
-def kinesis_awslogs_handler(event, context, metadata):
-    def reformat_record(record):
-        return {"awslogs": {"data": record["kinesis"]["data"]}}
+# Handle SQS events
+def sqs_handler(event, context, metadata, failed_item_ids=None):
+    """Parse all the messages of an SQS batch
 
-    return itertools.chain.from_iterable(
-        awslogs_handler(reformat_record(r), context, metadata) for r in event["Records"]
+    Messages carrying S3 event notifications, directly or in an SNS envelope, are
+    replaced by the content of the objects they reference, which are fetched
+    concurrently for the whole batch. Other messages are forwarded as one log.
+    """
+    base_metadata = copy.deepcopy(metadata)
+    messages = [
+        (record, get_s3_objects(parse_sqs_message_body(record["body"])))
+        for record in event["Records"]
+    ]
+    fetched_objects = map_concurrently(
+        get_s3_object_data,
+        [s3_object for _, s3_objects in messages for s3_object in s3_objects],
+        DD_S3_FETCH_WORKERS,
+        DD_S3_FETCH_MAX_PENDING_SIZE,
+        get_s3_object_size,
     )
 
+    for record, s3_objects in messages:
+        message_id = record.get("messageId")
+        message_fetched_objects = [next(fetched_objects) for _ in s3_objects]
+        # The logs of a message are only yielded once all of them were parsed, so
+        # that a failed message isn't partially forwarded before its redelivery.
+        # The metadata of each object is kept along its logs, as it is merged into
+        # them when they are consumed.
+        parsed_objects = []
+        try:
+            for (bucket, key, _), fetched_object in zip(
+                s3_objects, message_fetched_objects
+            ):
+                reset_metadata(metadata, base_metadata)
+                logs = list(
+                    s3_object_handler(fetched_object(), bucket, key, context, metadata)
+                )
+                parsed_objects.append((copy.deepcopy(metadata), logs))
+
+            if not s3_objects and not is_s3_test_event(record["body"]):
+                reset_metadata(metadata, base_metadata)
+                metadata[DD_SOURCE] = "sqs"
+                metadata[DD_SERVICE] = get_service_from_tags_and_remove_duplicates(
+                    metadata
+                )
+                log = {
+                    "aws": {
+                        "sqs": {
+                            "messageId": message_id,
+                            "eventSourceARN": record.get("eventSourceARN"),
+                        }
+                    },
+                    "message": record["body"],
+                }
+                parsed_objects.append((copy.deepcopy(metadata), [log]))
+        except Exception:
+            if failed_item_ids is None:
+                raise
+            logger.exception(f"Failed to parse the SQS message {message_id}")
+            failed_item_ids.append(message_id)
+            continue
+
+        for object_metadata, logs in parsed_objects:
+            reset_metadata(metadata, object_metadata)
+            for log in logs:
+                if failed_item_ids is not None:
+                    log[DD_BATCH_ITEM_ID] = message_id
+                yield log
+
+
+def parse_sqs_message_body(body):
+    """Returns the JSON payload of an SQS message, unwrapped from its SNS envelope
+    if the message was sent by an SNS subscription without raw message delivery
+    """
+    try:
+        payload = json.loads(body)
+        if payload.get("Type") == "Notification" and "Message" in payload:
+            payload = json.loads(payload["Message"])
+    except Exception:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def is_s3_test_event(body):
+    """S3 sends a test event when an event notification destination is configured"""
+    return parse_sqs_message_body(body).get("Event") == "s3:TestEvent"
+
+
+def reset_metadata(metadata, base_metadata):
+    """Restore the metadata of the invocation before parsing an item of a batch,
+    so the attributes set for one item don't leak to the next one
+    """
+    metadata.clear()
+    metadata.update(copy.deepcopy(base_metadata))
+
+
+def map_concurrently(func, items, max_workers, max_pending_size=None, size_of=None):
+    """Lazily apply func to the items on a thread pool, preserving their order
+
+    At most max_workers results are computed ahead of the consumer, which bounds
+    the memory held by the results that are not consumed yet. When
+    max_pending_size is set, the total size_of the items computed ahead of the
+    consumer is bounded as well, though at least one item is always computed.
+
+    Yields one callable per item, returning its result or raising the error
+    that func raised.
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield functools.partial(func, item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque()
+        pending_size = 0
+        for item in items:
+            item_size = size_of(item) if max_pending_size is not None else 0
+            while futures and (
+                len(futures) > max_workers
+                or (
+                    max_pending_size is not None
+                    and pending_size + item_size > max_pending_size
+                )
+            ):
+                future, size = futures.popleft()
+                pending_size -= size
+                yield future.result
+            futures.append((executor.submit(func, item), item_size))
+            pending_size += item_size
+        while futures:
+            yield futures.popleft()[0].result
+
+
+def get_s3_object_size(s3_object):
+    """Returns the size of a (bucket, key, size) S3 object prefetched at once, 0 if
+    it is unknown
+
+    The objects fetched as ranges are only fetched as they are read, a few
+    ranges ahead, they don't count towards the size of the prefetched objects.
+    """
+    if is_fetched_as_ranges(s3_object):
+        return 0
+    return s3_object[2] or 0
+
+
+# Handle CloudWatch logs from Kinesis
+def kinesis_awslogs_handler(event, context, metadata, failed_item_ids=None):
+    records = event["Records"]
+    decoded_records = decode_awslogs_records([r["kinesis"]["data"] for r in records])
+
+    if account_step_functions_tags_cache.should_fetch_tags():
+        # Fetch the tags of the state machines of the records decoded ahead in
+        # batches, rather than one state machine at a time
+        decoded_records = prefetch_state_machine_tags(decoded_records)
+
+    for record, decoded_record in zip(records, decoded_records):
+        sequence_number = record["kinesis"].get("sequenceNumber")
+        set_deduplication_item_id(sequence_number)
+        try:
+            events = list(process_awslogs(decoded_record(), context, metadata))
+        except Exception:
+            if failed_item_ids is None:
+                raise
+            logger.exception(
+                f"Failed to parse the Kinesis record with sequence number {sequence_number}"
+            )
+            failed_item_ids.append(sequence_number)
+            continue
+
+        for event in events:
+            if failed_item_ids is not None:
+                event[DD_BATCH_ITEM_ID] = sequence_number
+            yield event
+    set_deduplication_item_id(None)
+
+
+def get_result_now(get_result):
+    """Calls get_result right away, returns a callable returning its result or
+    raising its error"""
+    try:
+        result = get_result()
+    except Exception as e:
+        error = e
+
+        def raise_error():
+            raise error
+
+        return raise_error
+    return lambda: result
+
+
+def prefetch_state_machine_tags(decoded_records):
+    """Yields the decoded records, fetching the tags of the state machines of the
+    Step Functions logs of each chunk of DD_KINESIS_DECODE_WORKERS records first
+
+    The chunks are as large as the records decoded ahead of their parsing, so
+    that the batch isn't decoded all at once.
+    """
+    decoded_records = iter(decoded_records)
+    chunk_size = max(DD_KINESIS_DECODE_WORKERS, 1)
+    while True:
+        chunk = [
+            get_result_now(decoded_record)
+            for decoded_record in itertools.islice(decoded_records, chunk_size)
+        ]
+        if not chunk:
+            return
+
+        state_machine_arns = []
+        for decoded_record in chunk:
+            try:
+                logs = decoded_record()
+                if is_step_functions_awslogs(logs):
+                    state_machine_arns.append(get_state_machine_arn_from_awslogs(logs))
+            except Exception:
+                # The errors are handled when the record is processed
+                continue
+        if state_machine_arns:
+            account_step_functions_tags_cache.prefetch(state_machine_arns)
+        yield from chunk
+
+
+def decode_awslogs_records(records_data):
+    """Decode the CloudWatch Logs payloads of a batch of records, preserving their order
+
+    zlib releases the GIL while decompressing, so large batches are decoded
+    concurrently on up to DD_KINESIS_DECODE_WORKERS threads.
+
+    Yields one callable per record, returning its decoded payload or raising
+    the error that prevented decoding it.
+    """
+    workers = min(DD_KINESIS_DECODE_WORKERS, len(records_data))
+    return map_concurrently(decode_awslogs_data, records_data, workers)
+
 
 def normalize_events(events, metadata):
     normalized = []
@@ -868,6 +1644,22 @@ def normalize_events(events, metadata):
     return normalized
 
 
+def get_state_machine_arn_from_awslogs(logs):
+    """Returns the ARN of the state machine of the Step Functions logs, or an empty
+    string if their first log event doesn't have one"""
+    try:
+        return get_state_machine_arn(json.loads(logs["logEvents"][0]["message"]))
+    except Exception as e:
+        logger.debug("Unable to set stepfunction host or get state_machine_arn: %s" % e)
+        return ""
+
+
+def is_step_functions_awslogs(logs):
+    return logs["logStream"].startswith("states/") and (
+        find_cloudwatch_source(logs["logGroup"]) == "stepfunction"
+    )
+
+
 def get_state_machine_arn(message):
     if message.get("execution_arn") is not None:
         execution_arn = message["execution_arn"]
@@ -0,0 +1,147 @@
+# Unless explicitly stated otherwise all files in this repository are licensed
+# under the Apache License Version 2.0.
+# This product includes software developed at Datadog (https://www.datadoghq.com/).
+# Copyright 2021 Datadog, Inc.
+
+import json
+import logging
+import zlib
+from time import monotonic
+
+from datadog_lambda.metric import lambda_stats
+from telemetry import (
+    DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX,
+    get_forwarder_telemetry_tags,
+)
+from settings import (
+    DD_SOURCE,
+    DD_SERVICE,
+    DD_LOG_SAMPLING_RULES,
+)
+
+logger = logging.getLogger()
+
+
+class TokenBucket(object):
+    """Allows `rate` logs per second, with bursts of up to `burst` logs"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.last_refill = monotonic()
+
+    def consume(self):
+        now = monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SamplingRule(object):
+    """Samples and rate limits the logs of a source, service and/or log group
+
+    Logs are sampled deterministically on the hash of their id (or message), so
+    the redeliveries of a log are either all kept or all dropped. The token
+    bucket lives as long as the Lambda container, limiting the logs per second
+    across invocations.
+    """
+
+    def __init__(
+        self,
+        source=None,
+        service=None,
+        log_group=None,
+        sample_rate=1.0,
+        rate_limit=None,
+        burst=None,
+    ):
+        self.source = source
+        self.service = service
+        self.log_group = log_group
+        self.sample_rate = float(sample_rate)
+        self.token_bucket = (
+            TokenBucket(float(rate_limit), burst) if rate_limit is not None else None
+        )
+
+    def matches(self, log):
+        if self.source is not None and log.get(DD_SOURCE) != self.source:
+            return False
+        if self.service is not None and log.get(DD_SERVICE) != self.service:
+            return False
+        if self.log_group is not None and get_log_group(log) != self.log_group:
+            return False
+        return True
+
+    def is_sampled(self, log):
+        if self.sample_rate >= 1:
+            return True
+        key = str(log.get("id") or log.get("message", ""))
+        return zlib.crc32(key.encode("utf-8")) < self.sample_rate * 2**32
+
+    def is_rate_limited(self, log):
+        return self.token_bucket is not None and not self.token_bucket.consume()
+
+
+def get_log_group(log):
+    aws = log.get("aws")
+    if isinstance(aws, dict) and isinstance(aws.get("awslogs"), dict):
+        return aws["awslogs"].get("logGroup")
+    return None
+
+
+def parse_sampling_rules(config):
+    """Parse the DD_LOG_SAMPLING_RULES config, a JSON list of the SamplingRule
+    arguments, e.g. [{"source": "lambda", "sample_rate": 0.1, "rate_limit": 100}]
+    """
+    if config is None:
+        return []
+    try:
+        return [SamplingRule(**rule) for rule in json.loads(config)]
+    except Exception:
+        raise Exception("could not parse DD_LOG_SAMPLING_RULES: {}".format(config))
+
+
+sampling_rules = parse_sampling_rules(DD_LOG_SAMPLING_RULES)
+
+
+def sample_logs(logs, rules=None):
+    """Returns the logs kept by the first sampling rule matching each of them
+
+    Logs matching no rule are kept. The number of logs dropped by sampling and
+    by rate limiting are submitted as telemetry.
+    """
+    if rules is None:
+        rules = sampling_rules
+    if not rules:
+        return logs
+
+    kept_logs = []
+    sampled_out, rate_limited = 0, 0
+    for log in logs:
+        rule = next((rule for rule in rules if rule.matches(log)), None)
+        if rule is None:
+            kept_logs.append(log)
+        elif not rule.is_sampled(log):
+            sampled_out += 1
+        elif rule.is_rate_limited(log):
+            rate_limited += 1
+        else:
+            kept_logs.append(log)
+
+    if sampled_out or rate_limited:
+        logger.debug(
+            f"Dropped {sampled_out} sampled out and {rate_limited} rate limited logs"
+        )
+        for reason, count in [("sampling", sampled_out), ("rate_limit", rate_limited)]:
+            lambda_stats.distribution(
+                "{}.logs_sampled_out".format(DD_FORWARDER_TELEMETRY_NAMESPACE_PREFIX),
+                count,
+                tags=get_forwarder_telemetry_tags() + [f"reason:{reason}"],
+            )
+    return kept_logs
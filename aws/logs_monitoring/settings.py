@@ -103,6 +103,52 @@ DD_TAGS = get_env_var("DD_TAGS", "")
 ## @param DD_MAX_WORKERS - Max number of workers sending logs concurrently
 DD_MAX_WORKERS = int(os.getenv("DD_MAX_WORKERS", 20))
 
+## @param DD_REPORT_BATCH_ITEM_FAILURES - boolean - optional - default: false
+## Set this variable to `true` to return the identifiers of the Kinesis records or SQS
+## messages that could not be parsed or forwarded as a partial batch response, instead
+## of failing or acknowledging the whole batch. The event source mapping of the
+## forwarder must be configured with the `ReportBatchItemFailures` function response type.
+#
+DD_REPORT_BATCH_ITEM_FAILURES = get_env_var(
+    "DD_REPORT_BATCH_ITEM_FAILURES", "false", boolean=True
+)
+
+## @param DD_S3_FETCH_WORKERS - integer - optional - default: 10
+## Max number of S3 objects fetched concurrently, e.g. for the S3 event notifications
+## of an SQS batch.
+#
+DD_S3_FETCH_WORKERS = int(os.getenv("DD_S3_FETCH_WORKERS", 10))
+
+## @param DD_S3_FETCH_MAX_PENDING_SIZE - integer - optional - default: 67108864
+## Max total size in bytes of the S3 objects fetched ahead of their parsing, to bound
+## the memory used by DD_S3_FETCH_WORKERS concurrent fetches of large objects. An
+## object larger than this size is still fetched, on its own. The objects fetched as
+## byte ranges (see DD_S3_RANGED_GET_THRESHOLD) are only fetched as they are parsed.
+#
+DD_S3_FETCH_MAX_PENDING_SIZE = int(
+    os.getenv("DD_S3_FETCH_MAX_PENDING_SIZE", 64 * 1024**2)
+)
+
+## @param DD_S3_RANGED_GET_THRESHOLD - integer - optional - default: 67108864
+## Size in bytes above which uncompressed S3 objects are fetched as byte ranges of
+## DD_S3_RANGED_GET_PART_SIZE bytes, DD_S3_FETCH_WORKERS ranges at a time, and split
+## into lines as the ranges are received. Set it to 0 to always use a single request.
+#
+DD_S3_RANGED_GET_THRESHOLD = int(os.getenv("DD_S3_RANGED_GET_THRESHOLD", 64 * 1024**2))
+
+## @param DD_S3_RANGED_GET_PART_SIZE - integer - optional - default: 8388608
+## Size in bytes of the ranges of the S3 objects fetched as byte ranges.
+#
+DD_S3_RANGED_GET_PART_SIZE = int(os.getenv("DD_S3_RANGED_GET_PART_SIZE", 8 * 1024**2))
+
+## @param DD_KINESIS_DECODE_WORKERS - integer - optional - default: number of vCPUs
+## Number of threads decoding (base64, gunzip and JSON) the records of a Kinesis
+## batch concurrently. Set it to 1 to decode the records sequentially.
+#
+DD_KINESIS_DECODE_WORKERS = int(
+    os.getenv("DD_KINESIS_DECODE_WORKERS", os.cpu_count() or 1)
+)
+
 ## @param DD_API_URL - Url to use for  validating the the api key.
 DD_API_URL = get_env_var(
     "DD_API_URL",
@@ -183,6 +229,56 @@ SCRUBBING_RULE_CONFIGS = [
 INCLUDE_AT_MATCH = get_env_var("INCLUDE_AT_MATCH", default=None)
 EXCLUDE_AT_MATCH = get_env_var("EXCLUDE_AT_MATCH", default=None)
 
+# Projecting log fields
+# Option to drop or rename fields of the forwarded logs per source, as a JSON object
+# mapping a source (or "*" for the others) to the dotted paths of the fields to drop
+# and rename, e.g.
+# {"lambda": {"drop": ["id"], "rename": {"aws.awslogs.logStream": "stream"}}}
+DD_LOG_FIELD_PROJECTION = get_env_var("DD_LOG_FIELD_PROJECTION", default=None)
+
+# Sampling logs
+# Option to sample and rate limit the forwarded logs, as a JSON list of rules. The first
+# rule matching the "source", "service" and/or "log_group" of a log keeps a
+# "sample_rate" share of its logs, and at most "rate_limit" logs per second (with
+# bursts of "burst" logs), e.g. [{"source": "lambda", "sample_rate": 0.1}]
+DD_LOG_SAMPLING_RULES = get_env_var("DD_LOG_SAMPLING_RULES", default=None)
+
+# Deduplicating logs
+# Option to drop the CloudWatch log events whose id was already forwarded in the last
+# DD_DEDUP_WINDOW_SECONDS seconds by the same Lambda container, remembering at most
+# DD_DEDUP_MAX_EVENT_IDS ids. With DD_DEDUP_SEED_FILE (e.g. /tmp/event-ids.json), the
+# new ids are saved at the end of an invocation, at most every
+# DD_DEDUP_SEED_FILE_SAVE_INTERVAL_SECONDS seconds, and reloaded when the runtime
+# restarts.
+DD_DEDUP_WINDOW_SECONDS = int(get_env_var("DD_DEDUP_WINDOW_SECONDS", default=0))
+DD_DEDUP_MAX_EVENT_IDS = int(get_env_var("DD_DEDUP_MAX_EVENT_IDS", default=100000))
+DD_DEDUP_SEED_FILE = get_env_var("DD_DEDUP_SEED_FILE", default=None)
+DD_DEDUP_SEED_FILE_SAVE_INTERVAL_SECONDS = int(
+    get_env_var("DD_DEDUP_SEED_FILE_SAVE_INTERVAL_SECONDS", default=60)
+)
+
+# Generating metrics from logs
+# Option to count the logs matching a pattern, as count metrics, or collect the values
+# of one of their fields, as distribution metrics, as a JSON list of rules. See
+# log_metrics.LogMetricRule for the attributes of a rule, e.g.
+# [{"name": "alb.requests", "source": "elb", "tag_fields": ["elb_status_code"]}]
+DD_LOG_METRIC_RULES = get_env_var("DD_LOG_METRIC_RULES", default=None)
+
+# Aggregating metrics
+# Width in seconds of the time buckets the metrics forwarded from logs are aggregated
+# into before being submitted in bulk at the end of each invocation
+DD_METRICS_AGGREGATION_INTERVAL_SECONDS = int(
+    get_env_var("DD_METRICS_AGGREGATION_INTERVAL_SECONDS", default=10)
+)
+
+# DD_ENHANCED_METRICS_ROLLUP: when true, the estimated cost of the invocations of each
+# function is submitted summed per time bucket, along with the number of invocations
+# and cold starts (aws.lambda.enhanced.rolled_up_invocations and rolled_up_cold_starts),
+# instead of one estimated cost point per invocation
+DD_ENHANCED_METRICS_ROLLUP = get_env_var(
+    "DD_ENHANCED_METRICS_ROLLUP", "false", boolean=True
+)
+
 # Set boto3 timeout
 boto3_config = botocore.config.Config(
     connect_timeout=5, read_timeout=5, retries={"max_attempts": 2}
@@ -232,11 +328,39 @@ os.environ["DD_API_KEY"] = DD_API_KEY
 DD_MULTILINE_LOG_REGEX_PATTERN = get_env_var(
     "DD_MULTILINE_LOG_REGEX_PATTERN", default=None
 )
+# DD_MULTILINE_LOG_MAX_RECORD_SIZE: Max number of characters of a multiline log,
+# longer ones are cut into several logs
+DD_MULTILINE_LOG_MAX_RECORD_SIZE = int(
+    get_env_var("DD_MULTILINE_LOG_MAX_RECORD_SIZE", default=512 * 1000)
+)
+
+# DD_PARSE_S3_LOG_COLUMNS: Forward the lines of the ELB, CloudFront and VPC flow logs
+# S3 objects as the dict of their columns, instead of the raw line. Columns without
+# a value ("-") are dropped.
+DD_PARSE_S3_LOG_COLUMNS = get_env_var("DD_PARSE_S3_LOG_COLUMNS", "false", boolean=True)
+
+# DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN: Regular Expression Pattern matching the
+# first line of multiline CloudWatch logs. The following log events of the same log
+# stream are merged into the first one until the next match, or until the merged log
+# reaches DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES lines or
+# DD_CLOUDWATCH_MULTILINE_LOG_MAX_SIZE characters
+DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN = get_env_var(
+    "DD_CLOUDWATCH_MULTILINE_LOG_REGEX_PATTERN", default=None
+)
+DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES = int(
+    get_env_var("DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES", default=500)
+)
+DD_CLOUDWATCH_MULTILINE_LOG_MAX_SIZE = int(
+    get_env_var("DD_CLOUDWATCH_MULTILINE_LOG_MAX_SIZE", default=256 * 1000)
+)
 
 DD_SOURCE = "ddsource"
 DD_CUSTOM_TAGS = "ddtags"
 DD_SERVICE = "service"
 DD_HOST = "host"
+# Identifier of the batch item (e.g. Kinesis record) an event was parsed from,
+# removed from the event before it is forwarded
+DD_BATCH_ITEM_ID = "ddbatchitemid"
 DD_FORWARDER_VERSION = "3.100.0"
 
 # Additional target lambda invoked async with event data
@@ -252,4 +376,24 @@ DD_S3_STEP_FUNCTIONS_CACHE_FILENAME = "step-functions-cache.json"
 DD_S3_STEP_FUNCTIONS_CACHE_LOCK_FILENAME = "step-functions-cache.lock"
 
 DD_TAGS_CACHE_TTL_SECONDS = int(get_env_var("DD_TAGS_CACHE_TTL_SECONDS", default=300))
+# DD_TAGS_CACHE_NEGATIVE_TTL_SECONDS: how long the tags caches remember that a resource
+# fetched on its own has no tags
+DD_TAGS_CACHE_NEGATIVE_TTL_SECONDS = int(
+    get_env_var("DD_TAGS_CACHE_NEGATIVE_TTL_SECONDS", default=DD_TAGS_CACHE_TTL_SECONDS)
+)
+# DD_TAGS_CACHE_ERROR_TTL_SECONDS: how long the tags caches wait before fetching the tags
+# of a resource again after a failure, doubled on each consecutive failure
+DD_TAGS_CACHE_ERROR_TTL_SECONDS = int(
+    get_env_var("DD_TAGS_CACHE_ERROR_TTL_SECONDS", default=30)
+)
+# DD_TAGS_CACHE_REFRESH_AHEAD_SECONDS: how long before the TTL expiry the tags caches
+# start refreshing in the background
+DD_TAGS_CACHE_REFRESH_AHEAD_SECONDS = int(
+    get_env_var("DD_TAGS_CACHE_REFRESH_AHEAD_SECONDS", default=60)
+)
+# DD_TAGS_CACHE_GET_BUDGET_SECONDS: how long getting tags waits for the first fill of
+# a tags cache, after which the logs are forwarded without the tags
+DD_TAGS_CACHE_GET_BUDGET_SECONDS = float(
+    get_env_var("DD_TAGS_CACHE_GET_BUDGET_SECONDS", default=3)
+)
 DD_S3_CACHE_LOCK_TTL_SECONDS = 60
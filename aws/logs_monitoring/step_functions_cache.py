@@ -14,6 +14,9 @@ from settings import (
     DD_S3_STEP_FUNCTIONS_CACHE_LOCK_FILENAME,
 )
 
+# Max number of ARNs in the ResourceARNList of a GetResources call
+GET_RESOURCES_MAX_ARNS = 100
+
 
 class StepFunctionsTagsCache(BaseTagsCache):
     CACHE_FILENAME = DD_S3_STEP_FUNCTIONS_CACHE_FILENAME
@@ -72,15 +75,13 @@ class StepFunctionsTagsCache(BaseTagsCache):
         Returns:
             state_machine_tags (List[str]): the list of "key:value" Datadog tag strings
         """
-        if self._is_expired():
+        if self._refresh_if_expired():
             send_forwarder_internal_metrics("local_step_functions_tags_cache_expired")
             logger.debug(
-                "Local cache expired for Step Functions tags. Fetching cache from S3"
+                "Local cache expired for Step Functions tags. Refreshing it from S3"
             )
-            self._refresh()
 
-        state_machine_tags = self.tags_by_id.get(state_machine_arn, None)
-        if state_machine_tags is None:
+        if self.should_fetch_entry(state_machine_arn):
             # If the custom tag fetch env var is not set to true do not fetch
             if not self.should_fetch_tags():
                 logger.debug(
@@ -88,14 +89,41 @@ class StepFunctionsTagsCache(BaseTagsCache):
                     " is not set to true"
                 )
                 return []
-            state_machine_tags = get_state_machine_tags(state_machine_arn) or []
-            self.tags_by_id[state_machine_arn] = state_machine_tags
+            self.prefetch([state_machine_arn])
+
+        return self.tags_by_id.get(state_machine_arn, [])
 
-        return state_machine_tags
+    def prefetch(self, state_machine_arns):
+        """Fetch the tags of the state machines missing from the cache, or whose
+        entry expired, with one GetResources call per GET_RESOURCES_MAX_ARNS
+        state machines
 
+        The state machines without tags and the failed calls are cached too,
+        so that they are not fetched again before the TTL of their entry.
 
-def get_state_machine_tags(state_machine_arn: str):
-    """Return a list of tags of a state machine in dd format (max 200 chars)
+        Args:
+            state_machine_arns (Iterable[str]): the ARNs of the state machines
+        """
+        if not self.should_fetch_tags():
+            return
+
+        missing_arns = [
+            arn
+            for arn in dict.fromkeys(state_machine_arns)
+            if arn and self.should_fetch_entry(arn)
+        ]
+        for i in range(0, len(missing_arns), GET_RESOURCES_MAX_ARNS):
+            arns = missing_arns[i : i + GET_RESOURCES_MAX_ARNS]
+            tags_by_arn = get_state_machines_tags(arns)
+            for arn in arns:
+                self.set_entry(
+                    arn, tags_by_arn.get(arn, []) if tags_by_arn is not None else None
+                )
+
+
+def get_state_machines_tags(state_machine_arns):
+    """Return the tags of state machines in dd format (max 200 chars), with a single
+    GetResources call
 
     Example response from get source api:
     {
@@ -113,28 +141,30 @@ def get_state_machine_tags(state_machine_arn: str):
     }
 
     Args:
-            state_machine_arn (str): the key we're getting tags from the cache for
+        state_machine_arns (List[str]): at most GET_RESOURCES_MAX_ARNS ARNs
     Returns:
-        state_machine_arn (List[str]): e.g. ["k1:v1", "k2:v2"]
+        tags_by_arn (dict<str, List[str]>): the tags of the tagged state machines, e.g.
+            {"arn:aws:states:us-east-1:1234567890:stateMachine:example-machine": ["env:staging"]},
+            or None if the call failed
     """
-    response = None
-    formatted_tags = []
-
     try:
         send_forwarder_internal_metrics("get_state_machine_tags")
         response = resource_tagging_client.get_resources(
-            ResourceARNList=[state_machine_arn]
+            ResourceARNList=state_machine_arns
         )
     except Exception as e:
         logger.exception(f"Failed to get Step Functions tags due to {e}")
+        return None
 
-    if len(response.get("ResourceTagMappingList", {})) > 0:
-        resource_dict = response.get("ResourceTagMappingList")[0]
+    tags_by_arn = {}
+    for resource_dict in response.get("ResourceTagMappingList", []):
+        formatted_tags = []
         for a_tag in resource_dict.get("Tags", []):
             key = sanitize_aws_tag_string(a_tag["Key"], remove_colons=True)
             value = sanitize_aws_tag_string(
                 a_tag.get("Value"), remove_leading_digits=False
             )
             formatted_tags.append(f"{key}:{value}"[:200])  # same logic as lambda
+        tags_by_arn[resource_dict["ResourceARN"]] = formatted_tags
 
-    return formatted_tags
+    return tags_by_arn
@@ -0,0 +1,161 @@
+import unittest
+import sys
+import threading
+from time import time
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from base_tags_cache import (
+    BaseTagsCache,
+    TAGS_FETCH_ERROR,
+    TAGS_FOUND,
+    TAGS_NOT_FOUND,
+)
+
+
+class FakeTagsCache(BaseTagsCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refreshed = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self.refreshes = 0
+        self.tags = {"a": ["version:1"]}
+
+    def should_fetch_tags(self):
+        return True
+
+    def _refresh(self):
+        self.last_tags_fetch_time = time()
+        self.release.wait(5)
+        self.refreshes += 1
+        self.tags_by_id = dict(self.tags)
+        self.refreshed.set()
+
+    def get(self, key):
+        self._refresh_if_expired()
+        return self.tags_by_id.get(key, [])
+
+
+class TestBaseTagsCache(unittest.TestCase):
+    def test_first_refresh_is_waited_for(self):
+        cache = FakeTagsCache(tags_ttl_seconds=60)
+        self.assertEqual(cache.get("a"), ["version:1"])
+        self.assertEqual(cache.refreshes, 1)
+
+        # Not expired
+        self.assertEqual(cache.get("a"), ["version:1"])
+        self.assertEqual(cache.refreshes, 1)
+
+    def test_first_refresh_is_waited_for_within_budget(self):
+        cache = FakeTagsCache(tags_ttl_seconds=60, get_budget_seconds=0.01)
+        cache.release.clear()
+        self.assertEqual(cache.get("a"), [])
+        self.assertEqual(cache.get("a"), [])
+
+        cache.release.set()
+        cache._refresh_thread.join(5)
+        self.assertEqual(cache.get("a"), ["version:1"])
+        self.assertEqual(cache.refreshes, 1)
+
+    def test_cache_is_refreshed_ahead_of_expiry(self):
+        cache = FakeTagsCache(tags_ttl_seconds=60, refresh_ahead_seconds=10)
+        cache.get("a")
+        cache.tags = {"a": ["version:2"]}
+
+        cache.last_tags_fetch_time = time() - 45
+        self.assertFalse(cache._is_expired())
+        self.assertEqual(cache.get("a"), ["version:1"])
+        self.assertEqual(cache.refreshes, 1)
+
+        cache.last_tags_fetch_time = time() - 55
+        self.assertFalse(cache._is_expired())
+        cache.get("a")
+        cache._refresh_thread.join(5)
+        self.assertEqual(cache.refreshes, 2)
+        self.assertEqual(cache.get("a"), ["version:2"])
+
+    def test_expired_cache_is_refreshed_in_background(self):
+        cache = FakeTagsCache(tags_ttl_seconds=60)
+        cache.get("a")
+        cache.refreshed.clear()
+        cache.release.clear()
+        cache.tags = {"a": ["version:2"]}
+        cache.last_tags_fetch_time = time() - 120
+
+        # The previous tags are served while the refresh is running
+        self.assertEqual(cache.get("a"), ["version:1"])
+        self.assertEqual(cache.get("a"), ["version:1"])
+
+        cache.release.set()
+        cache._refresh_thread.join(5)
+        self.assertEqual(cache.refreshes, 2)
+        self.assertEqual(cache.get("a"), ["version:2"])
+
+    @patch("base_tags_cache.logger")
+    def test_background_refresh_failure_keeps_tags(self, logger):
+        cache = FakeTagsCache(tags_ttl_seconds=60)
+        cache.get("a")
+        cache.last_tags_fetch_time = time() - 120
+        with patch.object(cache, "_refresh", side_effect=Exception("throttled")):
+            cache.get("a")
+            cache._refresh_thread.join(5)
+        logger.exception.assert_called_once()
+        self.assertEqual(cache.get("a"), ["version:1"])
+
+    def test_entries_ttl_per_status(self):
+        cache = FakeTagsCache(
+            tags_ttl_seconds=300, negative_ttl_seconds=600, error_ttl_seconds=30
+        )
+        self.assertTrue(cache.should_fetch_entry("a"))
+
+        cache.set_entry("a", ["team:a"])
+        cache.set_entry("b", [])
+        cache.set_entry("c", None)
+        self.assertEqual(cache.tags_by_id, {"a": ["team:a"], "b": [], "c": []})
+        self.assertEqual(
+            [(e.status, e.ttl_seconds) for e in cache.entries.values()],
+            [(TAGS_FOUND, 300), (TAGS_NOT_FOUND, 600), (TAGS_FETCH_ERROR, 30)],
+        )
+        for key in ["a", "b", "c"]:
+            self.assertFalse(cache.should_fetch_entry(key))
+
+        cache.entries["a"].fetched_at -= 301
+        self.assertTrue(cache.should_fetch_entry("a"))
+        cache.entries["b"].fetched_at -= 301
+        self.assertFalse(cache.should_fetch_entry("b"))
+
+    def test_entries_errors_back_off(self):
+        cache = FakeTagsCache(tags_ttl_seconds=300, error_ttl_seconds=30)
+        cache.set_entry("a", ["team:a"])
+        for ttl_seconds in [30, 60, 120, 240, 300, 300]:
+            cache.set_entry("a", None)
+            self.assertEqual(cache.entries["a"].ttl_seconds, ttl_seconds)
+            # The tags fetched before the failures are kept
+            self.assertEqual(cache.tags_by_id["a"], ["team:a"])
+
+        cache.set_entry("a", ["team:b"])
+        cache.set_entry("a", None)
+        self.assertEqual(cache.entries["a"].ttl_seconds, 30)
+
+    def test_full_refresh_supersedes_entries(self):
+        cache = FakeTagsCache(tags_ttl_seconds=300)
+        cache.set_entry("a", None)
+        cache._set_tags_by_id({"a": ["team:a"]})
+        self.assertEqual(cache.entries, {})
+        self.assertFalse(cache.should_fetch_entry("a"))
+
+    def test_full_refresh_keeps_entries_fetched_meanwhile(self):
+        cache = FakeTagsCache(tags_ttl_seconds=300)
+        cache.set_entry("a", ["team:old"])
+        cache.entries["a"].fetched_at -= 10
+        refresh_started_at = time()
+        cache.set_entry("b", ["team:b"])
+        cache._set_tags_by_id({"a": ["team:a"], "b": []}, refresh_started_at)
+        self.assertEqual(cache.tags_by_id, {"a": ["team:a"], "b": ["team:b"]})
+        self.assertEqual(list(cache.entries), ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
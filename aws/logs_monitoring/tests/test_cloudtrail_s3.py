@@ -99,6 +99,7 @@ class TestS3CloudwatchParsing(unittest.TestCase):
         self.maxDiff = 9000
 
     @patch("base_tags_cache.boto3")
+    @patch("parsing.s3_client", None)
     @patch("parsing.boto3")
     @patch("lambda_function.boto3")
     def test_s3_cloudtrail_pasing_and_enrichment(
@@ -0,0 +1,113 @@
+import unittest
+import sys
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from cloudwatch_log_group_cache import CloudwatchLogGroupTagsCache
+
+
+class TestCloudwatchLogGroupTagsCache(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("cloudwatch_log_group_cache.send_forwarder_internal_metrics")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = CloudwatchLogGroupTagsCache()
+        self.cache.tags_by_id = {
+            "/aws/lambda/Tagged": ["team:old"],
+            "/aws/lambda/untagged": ["team:removed"],
+        }
+
+    @patch("cloudwatch_log_group_cache.get_log_group_tags")
+    @patch("cloudwatch_log_group_cache.resource_tagging_client")
+    def test_build_tags_cache_with_get_resources(
+        self, resource_tagging_client, get_log_group_tags
+    ):
+        paginator = MagicMock()
+        paginator.paginate.return_value = [
+            {
+                "ResourceTagMappingList": [
+                    {
+                        "ResourceARN": "arn:aws:logs:us-east-1:0:log-group:/aws/lambda/Tagged",
+                        "Tags": [{"Key": "team", "Value": "logs"}],
+                    },
+                ]
+            },
+            {
+                "ResourceTagMappingList": [
+                    {
+                        "ResourceARN": "arn:aws:logs:us-east-1:0:log-group:other:*",
+                        "Tags": [
+                            {"Key": "env", "Value": "prod"},
+                            {"Key": "flag", "Value": ""},
+                        ],
+                    },
+                ]
+            },
+        ]
+        resource_tagging_client.get_paginator.return_value = paginator
+
+        success, tags = self.cache.build_tags_cache()
+        self.assertTrue(success)
+        self.assertEqual(
+            tags,
+            {
+                "/aws/lambda/Tagged": ["team:logs"],
+                "/aws/lambda/untagged": [],
+                "other": ["env:prod", "flag"],
+            },
+        )
+        paginator.paginate.assert_called_once_with(
+            ResourceTypeFilters=["logs:log-group"], ResourcesPerPage=100
+        )
+        get_log_group_tags.assert_not_called()
+
+    @patch("cloudwatch_log_group_cache.get_log_group_tags")
+    @patch("cloudwatch_log_group_cache.resource_tagging_client")
+    def test_build_tags_cache_falls_back_to_list_tags(
+        self, resource_tagging_client, get_log_group_tags
+    ):
+        resource_tagging_client.get_paginator.return_value.paginate.side_effect = (
+            ClientError({"ResponseMetadata": {"HTTPStatusCode": 403}}, "GetResources")
+        )
+        get_log_group_tags.side_effect = lambda log_group: (
+            ["team:logs"] if log_group == "/aws/lambda/Tagged" else None
+        )
+
+        success, tags = self.cache.build_tags_cache()
+        self.assertTrue(success)
+        # The cached tags are kept when ListTagsLogGroup fails
+        self.assertEqual(
+            tags,
+            {
+                "/aws/lambda/Tagged": ["team:logs"],
+                "/aws/lambda/untagged": ["team:removed"],
+            },
+        )
+        self.assertEqual(get_log_group_tags.call_count, 2)
+
+    @patch.dict("os.environ", {"DD_FETCH_LOG_GROUP_TAGS": "true"})
+    @patch("cloudwatch_log_group_cache.get_log_group_tags")
+    def test_get_caches_missing_and_failed_log_groups(self, get_log_group_tags):
+        self.cache.last_tags_fetch_time = float("inf")
+        get_log_group_tags.return_value = []
+        self.assertEqual(self.cache.get("/aws/lambda/new"), [])
+        self.assertEqual(self.cache.get("/aws/lambda/new"), [])
+        get_log_group_tags.assert_called_once()
+
+        get_log_group_tags.return_value = None
+        self.assertEqual(self.cache.get("/aws/lambda/failing"), [])
+        self.assertEqual(self.cache.get("/aws/lambda/failing"), [])
+        self.assertEqual(get_log_group_tags.call_count, 2)
+
+        # Retried once the error TTL expired
+        self.cache.entries["/aws/lambda/failing"].fetched_at -= 3600
+        get_log_group_tags.return_value = ["team:logs"]
+        self.assertEqual(self.cache.get("/aws/lambda/failing"), ["team:logs"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from dedup import EventIdDeduplicator
+
+
+class TestEventIdDeduplicator(unittest.TestCase):
+    def test_duplicates_within_the_window(self):
+        deduplicator = EventIdDeduplicator(60, 10)
+        with patch("dedup.time", return_value=0):
+            self.assertFalse(deduplicator.is_duplicate("1"))
+            self.assertTrue(deduplicator.is_duplicate("1"))
+            deduplicator.commit()
+        with patch("dedup.time", return_value=60):
+            self.assertTrue(deduplicator.is_duplicate("1"))
+        with patch("dedup.time", return_value=61):
+            self.assertFalse(deduplicator.is_duplicate("1"))
+
+    def test_discarded_ids_are_not_duplicates(self):
+        deduplicator = EventIdDeduplicator(60, 10)
+        self.assertFalse(deduplicator.is_duplicate("1"))
+        deduplicator.discard()
+        self.assertFalse(deduplicator.is_duplicate("1"))
+
+    def test_ids_of_failed_items_are_not_committed(self):
+        deduplicator = EventIdDeduplicator(60, 10)
+        for item_id, event_id in [("a", "1"), ("b", "2"), (None, "3")]:
+            deduplicator.item_id = item_id
+            deduplicator.is_duplicate(event_id)
+        deduplicator.commit(["b"])
+        self.assertEqual(
+            [deduplicator.is_duplicate(event_id) for event_id in "123"],
+            [True, False, True],
+        )
+
+    def test_oldest_ids_are_evicted(self):
+        deduplicator = EventIdDeduplicator(60, 3)
+        for event_id in "1234":
+            deduplicator.is_duplicate(event_id)
+        deduplicator.commit()
+        deduplicator.discard()
+        self.assertEqual(
+            [deduplicator.is_duplicate(event_id) for event_id in "1234"],
+            [False, True, True, True],
+        )
+
+    def test_save_and_load(self):
+        deduplicator = EventIdDeduplicator(60, 10)
+        deduplicator.is_duplicate("1")
+        deduplicator.commit()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "event-ids.json")
+            deduplicator.save(path)
+            loaded = EventIdDeduplicator(60, 10)
+            loaded.load(path)
+            loaded.load(os.path.join(directory, "missing.json"))
+        self.assertTrue(loaded.is_duplicate("1"))
+        self.assertFalse(loaded.is_duplicate("2"))
+
+    def test_unchanged_ids_are_not_saved(self):
+        deduplicator = EventIdDeduplicator(60, 10)
+        deduplicator.is_duplicate("1")
+        deduplicator.commit()
+        with patch("dedup.open") as mock_open, patch("dedup.os.replace"):
+            deduplicator.save("event-ids.json")
+            deduplicator.commit()
+            deduplicator.save("event-ids.json")
+        self.assertEqual(mock_open.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,28 @@
 import unittest
+import json
 import os
+import sys
 from time import time
 from botocore.exceptions import ClientError
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 from unittest import mock
 
+sys.modules["datadog"] = MagicMock()
+
+import enhanced_lambda_metrics
 from enhanced_lambda_metrics import (
+    parse_and_submit_enhanced_metrics,
     parse_metrics_from_report_log,
     parse_lambda_tags_from_arn,
     generate_enhanced_lambda_metrics,
     create_out_of_memory_enhanced_metric,
+    create_timeout_enhanced_metric,
+    calculate_estimated_cost,
+    parse_metrics_from_platform_record,
+    parse_platform_log_record,
+    OUT_OF_MEMORY_ERROR_STRINGS,
+    OUT_OF_MEMORY_LITERAL,
 )
 
 from base_tags_cache import (
@@ -19,6 +31,11 @@ from base_tags_cache import (
     get_dd_tag_string_from_aws_dict,
 )
 from lambda_cache import LambdaTagsCache
+from metrics_aggregator import MetricsAggregator
+
+
+def metric_to_dict(metric):
+    return {slot: getattr(metric, slot) for slot in metric.__slots__}
 
 
 class TestEnhancedLambdaMetrics(unittest.TestCase):
@@ -147,7 +164,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         # The timestamps are None because the timestamp is added after the metrics are parsed
         self.assertListEqual(
-            [metric.__dict__ for metric in parsed_metrics],
+            [metric_to_dict(metric) for metric in parsed_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.duration",
@@ -190,7 +207,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         parsed_metrics = parse_metrics_from_report_log(self.cold_start_report)
         self.assertEqual(
-            [metric.__dict__ for metric in parsed_metrics],
+            [metric_to_dict(metric) for metric in parsed_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.duration",
@@ -241,7 +258,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         )
         parsed_metrics = parse_metrics_from_report_log(self.report_with_xray)
         self.assertListEqual(
-            [metric.__dict__ for metric in parsed_metrics],
+            [metric_to_dict(metric) for metric in parsed_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.duration",
@@ -313,6 +330,20 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         success_message = "Success!"
         self.assertEqual(len(create_out_of_memory_enhanced_metric(success_message)), 0)
 
+    def test_prefilter_literals(self):
+        # Every string matched by the regexes must contain the prefilter literal
+        for s in OUT_OF_MEMORY_ERROR_STRINGS:
+            self.assertIn(OUT_OF_MEMORY_LITERAL, s)
+            self.assertEqual(len(create_out_of_memory_enhanced_metric(s)), 1)
+        self.assertEqual(
+            len(create_timeout_enhanced_metric("Task timed\tout after 3.00 seconds")),
+            1,
+        )
+        self.assertEqual(
+            len(create_timeout_enhanced_metric("Task took 3.00 seconds")), 0
+        )
+        self.assertEqual(len(parse_metrics_from_report_log("START RequestId: 1")), 0)
+
     @patch("base_tags_cache.send_forwarder_internal_metrics")
     @patch("lambda_cache.LambdaTagsCache.get_cache_from_s3")
     def test_generate_enhanced_lambda_metrics(
@@ -352,7 +383,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
         self.assertEqual(
-            [metric.__dict__ for metric in generated_metrics],
+            [metric_to_dict(metric) for metric in generated_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.duration",
@@ -449,7 +480,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
         self.assertEqual(
-            [metric.__dict__ for metric in generated_metrics],
+            [metric_to_dict(metric) for metric in generated_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.duration",
@@ -761,7 +792,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
         self.assertEqual(
-            [metric.__dict__ for metric in generated_metrics],
+            [metric_to_dict(metric) for metric in generated_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.timeouts",
@@ -819,7 +850,7 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
 
         generated_metrics = generate_enhanced_lambda_metrics(logs_input, tags_cache)
         self.assertEqual(
-            [metric.__dict__ for metric in generated_metrics],
+            [metric_to_dict(metric) for metric in generated_metrics],
             [
                 {
                     "name": "aws.lambda.enhanced.out_of_memory",
@@ -840,6 +871,185 @@ class TestEnhancedLambdaMetrics(unittest.TestCase):
         )
         del os.environ["DD_FETCH_LAMBDA_TAGS"]
 
+    def test_parse_metrics_from_platform_records(self):
+        report = {
+            "time": "2023-11-14T22:01:05.000Z",
+            "type": "platform.report",
+            "record": {
+                "requestId": "8edab1f8-7d34-4a8e-a965-15ccbbb78d4c",
+                "status": "success",
+                "metrics": {
+                    "durationMs": 0.62,
+                    "billedDurationMs": 100,
+                    "memorySizeMB": 128,
+                    "maxMemoryUsedMB": 51,
+                },
+            },
+        }
+        # Same metrics as the text REPORT log
+        self.assertEqual(
+            [
+                metric_to_dict(metric)
+                for metric in parse_metrics_from_platform_record(
+                    parse_platform_log_record(json.dumps(report))
+                )
+            ],
+            [
+                metric_to_dict(metric)
+                for metric in parse_metrics_from_report_log(self.standard_report)
+            ],
+        )
+
+        report["record"]["metrics"]["initDurationMs"] = 1234
+        metrics = parse_metrics_from_platform_record(parse_platform_log_record(report))
+        self.assertEqual(
+            [(metric.name, metric.value) for metric in metrics][3],
+            ("aws.lambda.enhanced.init_duration", 1.234),
+        )
+        self.assertIn("cold_start:true", metrics[0].tags)
+
+        runtime_done = {
+            "type": "platform.runtimeDone",
+            "record": {"requestId": "1", "status": "timeout"},
+        }
+        metrics = parse_metrics_from_platform_record(runtime_done)
+        self.assertEqual(
+            [(metric.name, metric.value) for metric in metrics],
+            [("aws.lambda.enhanced.timeouts", 1.0)],
+        )
+        runtime_done["record"]["status"] = "success"
+        self.assertEqual(parse_metrics_from_platform_record(runtime_done), [])
+
+        init_report = {
+            "type": "platform.initReport",
+            "record": {
+                "initializationType": "provisioned-concurrency",
+                "phase": "init",
+                "status": "success",
+                "metrics": {"durationMs": 500.0},
+            },
+        }
+        metrics = parse_metrics_from_platform_record(init_report)
+        self.assertEqual(
+            [metric_to_dict(metric) for metric in metrics],
+            [
+                {
+                    "name": "aws.lambda.enhanced.init_duration",
+                    "value": 0.5,
+                    "timestamp": None,
+                    "tags": ["init_type:provisioned-concurrency", "status:success"],
+                }
+            ],
+        )
+        # On-demand init durations are reported by platform.report
+        init_report["record"]["initializationType"] = "on-demand"
+        self.assertEqual(parse_metrics_from_platform_record(init_report), [])
+
+    def test_parse_platform_log_record(self):
+        self.assertIsNone(parse_platform_log_record(self.standard_report))
+        self.assertIsNone(parse_platform_log_record('{"type": "platform.start"}'))
+        self.assertIsNone(parse_platform_log_record('{"message": "platform.report"'))
+        self.assertIsNone(
+            parse_platform_log_record(
+                {"level": "INFO", "message": "platform.report", "record": {}}
+            )
+        )
+
+    @patch("enhanced_lambda_metrics.metrics_aggregator", MetricsAggregator())
+    @patch("enhanced_lambda_metrics.DD_SUBMIT_ENHANCED_METRICS", True)
+    @patch("enhanced_lambda_metrics.account_lambda_custom_tags_cache")
+    def test_parse_and_submit_enhanced_metrics(self, tags_cache):
+        tags_cache.get.return_value = ["team:metrics"]
+        arn = "arn:aws:lambda:us-east-1:0:function:test"
+        logs = [
+            {"message": self.standard_report, "lambda": {"arn": arn}, "timestamp": 10},
+            {"message": "START RequestId: 1", "lambda": {"arn": arn}, "timestamp": 11},
+            {"message": self.standard_report, "lambda": {"arn": arn}, "timestamp": 12},
+        ]
+        parse_and_submit_enhanced_metrics(logs)
+
+        # The custom tags of the function are fetched once for all its logs
+        tags_cache.get.assert_called_once_with(arn)
+        distributions = enhanced_lambda_metrics.metrics_aggregator.get_distributions()
+        self.assertEqual(len(distributions), 4)
+        for distribution in distributions:
+            self.assertIn("functionname:test", distribution["tags"])
+            self.assertIn("team:metrics", distribution["tags"])
+            self.assertEqual(sum(len(v) for _, v in distribution["points"]), 2)
+
+    def test_calculate_estimated_cost_arm64(self):
+        self.assertAlmostEqual(
+            calculate_estimated_cost(1000, 1024), 0.0000002 + 0.0000166667
+        )
+        self.assertAlmostEqual(
+            calculate_estimated_cost(1000, 1024, architecture="arm64"),
+            0.0000002 + 0.0000133334,
+        )
+
+    def test_generate_enhanced_lambda_metrics_arm64(self):
+        tags_cache = mock.MagicMock()
+        tags_cache.get.return_value = ["architecture:arm64"]
+        log = {
+            "message": self.standard_report,
+            "lambda": {"arn": "arn:aws:lambda:us-east-1:0:function:test"},
+            "timestamp": 10000,
+        }
+        metrics = generate_enhanced_lambda_metrics(log, tags_cache)
+        self.assertEqual(metrics[-1].name, "aws.lambda.enhanced.estimated_cost")
+        self.assertAlmostEqual(
+            metrics[-1].value, calculate_estimated_cost(100, 128, "arm64")
+        )
+
+    @patch("enhanced_lambda_metrics.metrics_aggregator", MetricsAggregator())
+    @patch("enhanced_lambda_metrics.DD_ENHANCED_METRICS_ROLLUP", True)
+    @patch("enhanced_lambda_metrics.DD_SUBMIT_ENHANCED_METRICS", True)
+    @patch("enhanced_lambda_metrics.account_lambda_custom_tags_cache")
+    def test_parse_and_submit_enhanced_metrics_rollup(self, tags_cache):
+        tags_cache.get.return_value = []
+        arn = "arn:aws:lambda:us-east-1:0:function:test"
+        logs = [
+            {"message": report, "lambda": {"arn": arn}, "timestamp": timestamp}
+            for report, timestamp in [
+                (self.cold_start_report, 1000000),
+                (self.standard_report, 1001000),
+                (self.standard_report, 1009999),
+                (self.standard_report, 1010000),
+            ]
+        ]
+        parse_and_submit_enhanced_metrics(logs)
+
+        points = {}
+        for (
+            distribution
+        ) in enhanced_lambda_metrics.metrics_aggregator.get_distributions():
+            cold_start = "cold_start:true" in distribution["tags"]
+            for bucket, values in distribution["points"]:
+                points[(distribution["metric"], cold_start, bucket)] = values
+
+        cost = calculate_estimated_cost(100, 128)
+        self.assertEqual(
+            points[("aws.lambda.enhanced.estimated_cost", False, 1000)], [cost * 2]
+        )
+        self.assertEqual(
+            points[("aws.lambda.enhanced.estimated_cost", False, 1010)], [cost]
+        )
+        self.assertEqual(
+            points[("aws.lambda.enhanced.rolled_up_invocations", False, 1000)], [2]
+        )
+        self.assertEqual(
+            points[("aws.lambda.enhanced.rolled_up_invocations", True, 1000)], [1]
+        )
+        self.assertEqual(
+            points[("aws.lambda.enhanced.rolled_up_cold_starts", True, 1000)], [1]
+        )
+        self.assertNotIn(
+            ("aws.lambda.enhanced.rolled_up_cold_starts", False, 1000), points
+        )
+        # The durations keep all their values
+        self.assertEqual(
+            points[("aws.lambda.enhanced.duration", False, 1000)], [0.00062, 0.00062]
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
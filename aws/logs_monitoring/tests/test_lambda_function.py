@@ -27,6 +27,7 @@ env_patch = patch.dict(
 )
 env_patch.start()
 from lambda_function import (
+    datadog_forwarder,
     invoke_additional_target_lambdas,
     extract_metric,
     extract_host_from_cloudtrails,
@@ -38,7 +39,7 @@ from lambda_function import (
     split,
     extract_ddtags_from_message,
 )
-from parsing import parse, parse_event_type
+from parsing import parse, parse_event_type, LogEvent
 
 env_patch.stop()
 
@@ -117,6 +118,46 @@ class TestExtractMetric(unittest.TestCase):
         self.assertEqual(extract_metric({"e": 0, "v": None, "m": "foo", "t": []}), None)
 
 
+class TestSplit(unittest.TestCase):
+    def test_split_metrics_and_logs(self):
+        metric = {"e": 1, "v": 1, "m": "foo", "t": ["env:dev"]}
+        events = [
+            {"message": " " + json.dumps(metric), "ddtags": "team:a"},
+            {"message": "plain text log"},
+            {"message": '["m", "v", "e", "t"]'},
+            {"message": '{"m": "not a metric"}'},
+            {"message": {"m": "foo"}},
+        ]
+
+        metrics, logs, trace_payloads = split(events)
+
+        self.assertEqual(
+            metrics, [{"e": 1, "v": 1, "m": "foo", "t": ["env:dev", "team:a"]}]
+        )
+        self.assertEqual(logs, events[1:])
+        self.assertEqual(trace_payloads, [])
+
+    def test_cloudwatch_log_event_message_decoded_once(self):
+        event = LogEvent(
+            {
+                "ddsource": "cloudtrail",
+                "message": json.dumps(
+                    {
+                        "userIdentity": {
+                            "arn": "arn:aws:sts::601427279990:assumed-role/role/i-99999999"
+                        }
+                    }
+                ),
+            }
+        )
+        with patch("parsing.json.loads", wraps=json.loads) as mock_loads:
+            metrics, logs, trace_payloads = split(enrich([event]))
+
+        self.assertEqual(logs, [event])
+        self.assertEqual(event["host"], "i-99999999")
+        self.assertEqual(mock_loads.call_count, 1)
+
+
 class Context:
     function_version = 0
     invoked_function_arn = "arn:aws:lambda:sa-east-1:601427279990:function:inferred-spans-python-dev-initsender"
@@ -292,6 +333,78 @@ class TestLambdaFunctionEndToEnd(unittest.TestCase):
         return input_data
 
 
+class TestBatchItemFailures(unittest.TestCase):
+    def create_kinesis_record(self, sequence_number, data):
+        return {
+            "kinesis": {
+                "sequenceNumber": sequence_number,
+                "data": create_cloudwatch_log_event_from_data(data),
+            }
+        }
+
+    @patch("lambda_function.invoke_additional_target_lambdas")
+    @patch("lambda_function.parse_and_submit_enhanced_metrics")
+    @patch("lambda_function.forward_logs")
+    @patch("cloudwatch_log_group_cache.CloudwatchLogGroupTagsCache.get")
+    @patch("lambda_function.DD_REPORT_BATCH_ITEM_FAILURES", True)
+    def test_datadog_forwarder_reports_failed_records(
+        self,
+        cw_logs_tags_get,
+        mock_forward_logs,
+        mock_enhanced_metrics,
+        mock_invoke_additional_target_lambdas,
+    ):
+        cw_logs_tags_get.return_value = []
+        mock_forward_logs.return_value = {"3"}
+        records = [
+            json.dumps(
+                {
+                    "owner": "123456789012",
+                    "logGroup": "/aws/my-group",
+                    "logStream": "stream",
+                    "logEvents": [
+                        {"id": str(i), "timestamp": 1609556645000, "message": "hi"}
+                    ],
+                }
+            )
+            for i in range(3)
+        ]
+        event = {
+            "Records": [
+                self.create_kinesis_record("1", records[0]),
+                self.create_kinesis_record("2", "not a CloudWatch Logs payload"),
+                self.create_kinesis_record("3", records[2]),
+            ]
+        }
+
+        response = datadog_forwarder(event, Context())
+
+        self.assertEqual(
+            response,
+            {"batchItemFailures": [{"itemIdentifier": "2"}, {"itemIdentifier": "3"}]},
+        )
+        forwarded_logs = mock_forward_logs.call_args[0][0]
+        self.assertEqual(
+            [log["ddbatchitemid"] for log in forwarded_logs],
+            ["1", "3"],
+        )
+
+    @patch("lambda_function.invoke_additional_target_lambdas")
+    @patch("lambda_function.parse_and_submit_enhanced_metrics")
+    @patch("lambda_function.forward_logs")
+    def test_datadog_forwarder_without_batch_item_failures(
+        self,
+        mock_forward_logs,
+        mock_enhanced_metrics,
+        mock_invoke_additional_target_lambdas,
+    ):
+        event = {"detail": {"key": "value"}, "source": "aws.guardduty"}
+
+        self.assertIsNone(datadog_forwarder(event, Context()))
+        forwarded_logs = mock_forward_logs.call_args[0][0]
+        self.assertNotIn("ddbatchitemid", forwarded_logs[0])
+
+
 class TestLambdaFunctionExtractTracePayload(unittest.TestCase):
     def test_extract_trace_payload_none_no_trace(self):
         message_json = """{
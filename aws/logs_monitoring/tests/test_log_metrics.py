@@ -0,0 +1,84 @@
+import unittest
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+sys.modules["datadog"] = MagicMock()
+
+import log_metrics
+from metrics_aggregator import MetricsAggregator
+from log_metrics import (
+    LogMetricRule,
+    parse_log_metric_rules,
+    submit_log_metrics,
+)
+
+
+class TestLogMetrics(unittest.TestCase):
+    def setUp(self):
+        self.logs = [
+            {"ddsource": "nginx", "message": "GET /a 200 0.120"},
+            {"ddsource": "nginx", "message": "GET /b 200 0.080"},
+            {"ddsource": "nginx", "message": "POST /a 500 1.500"},
+            {"ddsource": "nginx", "message": "unrelated line"},
+            {"ddsource": "elb", "message": {"elb_status_code": "502", "type": "h2"}},
+            {"ddsource": "lambda", "message": "GET /a 200 0.120"},
+        ]
+        self.rules = parse_log_metric_rules("""[
+                {
+                    "name": "nginx.requests",
+                    "source": "nginx",
+                    "pattern": "^(?P<method>\\\\S+) \\\\S+ (?P<status>\\\\d+)",
+                    "tag_fields": ["method", "status"],
+                    "tags": ["team:web"]
+                },
+                {
+                    "name": "nginx.latency",
+                    "type": "distribution",
+                    "source": "nginx",
+                    "pattern": "(?P<latency>[\\\\d.]+)$",
+                    "value": "latency"
+                },
+                {"name": "elb.requests", "source": "elb", "tag_fields": ["elb_status_code"]}
+            ]""")
+
+    @patch("log_metrics.metrics_aggregator", MetricsAggregator(interval=10))
+    def test_submit_log_metrics(self):
+        for i, log in enumerate(self.logs):
+            log["timestamp"] = 1000000 + i * 5000
+        submit_log_metrics(self.logs, self.rules)
+
+        counts = {
+            (c["metric"], tuple(c["tags"])): c["points"]
+            for c in log_metrics.metrics_aggregator.get_counts()
+        }
+        self.assertEqual(
+            counts,
+            {
+                ("nginx.requests", ("method:GET", "status:200", "team:web")): [
+                    (1000, 2)
+                ],
+                ("nginx.requests", ("method:POST", "status:500", "team:web")): [
+                    (1010, 1)
+                ],
+                ("elb.requests", ("elb_status_code:502",)): [(1020, 1)],
+            },
+        )
+        distributions = {
+            (d["metric"], tuple(d["tags"])): d["points"]
+            for d in log_metrics.metrics_aggregator.get_distributions()
+        }
+        self.assertEqual(
+            distributions,
+            {("nginx.latency", ()): [(1000, [0.12, 0.08]), (1010, [1.5])]},
+        )
+
+    def test_invalid_rules(self):
+        with self.assertRaises(Exception):
+            parse_log_metric_rules('[{"name": "a", "type": "distribution"}]')
+        with self.assertRaises(Exception):
+            LogMetricRule("a", type="gauge")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,23 @@
+import copy
+import json
 import unittest
 import os
+from unittest.mock import MagicMock, patch
 
-from logs import DatadogScrubber, filter_logs
-from settings import ScrubbingRuleConfig, SCRUBBING_RULE_CONFIGS, get_env_var
+from logs import (
+    DatadogHTTPClient,
+    DatadogScrubber,
+    filter_logs,
+    forward_logs,
+    parse_log_field_projections,
+    project_log_fields,
+)
+from settings import (
+    DD_BATCH_ITEM_ID,
+    ScrubbingRuleConfig,
+    SCRUBBING_RULE_CONFIGS,
+    get_env_var,
+)
 
 
 class TestScrubLogs(unittest.TestCase):
@@ -80,3 +95,112 @@ class TestFilterLogs(unittest.TestCase):
     def test_no_filtering_rules(self):
         filtered_logs = filter_logs(self.example_logs)
         self.assertEqual(filtered_logs, self.example_logs)
+
+
+class TestProjectLogFields(unittest.TestCase):
+    def test_project_log_fields(self):
+        projections = parse_log_field_projections(
+            '{"lambda": {"drop": ["id", "aws.awslogs", "missing.key"],'
+            ' "rename": {"aws.awslogs.logGroup": "log.group", "ddsourcecategory": "c"}}}'
+        )
+        log = {
+            "id": "1",
+            "message": "hello",
+            "ddsourcecategory": "aws",
+            "aws": {
+                "awslogs": {"logGroup": "group", "logStream": "stream"},
+                "function_version": "$LATEST",
+            },
+        }
+        original = copy.deepcopy(log)
+
+        projected = project_log_fields(log, projections["lambda"])
+
+        self.assertEqual(
+            projected,
+            {
+                "message": "hello",
+                "c": "aws",
+                "aws": {"function_version": "$LATEST"},
+                "log": {"group": "group"},
+            },
+        )
+        self.assertEqual(log, original)
+
+    @patch("logs.DD_USE_TCP", False)
+    @patch("logs.DatadogHTTPClient")
+    def test_logs_are_filtered_before_their_projection(self, mock_http_client):
+        mock_http_client.return_value.failed_logs = ['{"message": "world"}']
+        projections = parse_log_field_projections('{"*": {"drop": ["secret"]}}')
+        logs = [
+            {"message": "hello", "secret": "excluded", DD_BATCH_ITEM_ID: "1"},
+            {"message": "world", "secret": "kept", DD_BATCH_ITEM_ID: "2"},
+        ]
+
+        with patch("logs.log_field_projections", projections), patch(
+            "logs.EXCLUDE_AT_MATCH", "excluded"
+        ):
+            self.assertEqual(forward_logs(logs), {"2"})
+
+        mock_http_client.return_value.send.assert_called_once_with(
+            ['{"message": "world"}']
+        )
+
+    @patch("logs.DD_USE_TCP", False)
+    @patch("logs.DatadogHTTPClient")
+    def test_logs_are_serialized_once_without_filters(self, mock_http_client):
+        mock_http_client.return_value.failed_logs = []
+        projections = parse_log_field_projections('{"*": {"drop": ["secret"]}}')
+        logs = [{"message": "hello", "secret": "dropped"}]
+
+        with patch("logs.log_field_projections", projections), patch(
+            "logs.json.dumps", wraps=json.dumps
+        ) as mock_dumps:
+            self.assertEqual(forward_logs(logs), set())
+
+        mock_dumps.assert_called_once()
+        mock_http_client.return_value.send.assert_called_once_with(
+            ['{"message": "hello"}']
+        )
+
+    def test_invalid_projection(self):
+        self.assertEqual(parse_log_field_projections(None), {})
+        with self.assertRaises(Exception):
+            parse_log_field_projections('{"lambda": ["id"]}')
+
+
+class TestDatadogHTTPClient(unittest.TestCase):
+    def test_failed_batches_are_recorded(self):
+        client = DatadogHTTPClient(
+            "localhost", 443, False, False, "abc", DatadogScrubber([])
+        )
+        client._session = MagicMock()
+        successful_future, failed_future = MagicMock(), MagicMock()
+        successful_future.result.return_value.status_code = 202
+        failed_future.result.side_effect = Exception("connection reset")
+        client._session.post.side_effect = [successful_future, failed_future]
+
+        with patch("logs.as_completed", side_effect=list):
+            client.send(['{"message": "a"}'])
+            client.send(['{"message": "b"}', '{"message": "c"}'])
+            client._close()
+
+        self.assertEqual(client.failed_logs, ['{"message": "b"}', '{"message": "c"}'])
+
+    def test_rejected_batches_are_recorded(self):
+        client = DatadogHTTPClient(
+            "localhost", 443, False, False, "abc", DatadogScrubber([])
+        )
+        client._session = MagicMock()
+        futures = [MagicMock() for _ in range(3)]
+        for future, status_code in zip(futures, [200, 500, 429]):
+            future.result.return_value.status_code = status_code
+        client._session.post.side_effect = futures
+
+        with patch("logs.as_completed", side_effect=list):
+            client.send(['{"message": "a"}'])
+            client.send(['{"message": "b"}'])
+            client.send(['{"message": "c"}'])
+            client._close()
+
+        self.assertEqual(client.failed_logs, ['{"message": "b"}', '{"message": "c"}'])
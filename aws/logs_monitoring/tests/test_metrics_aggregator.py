@@ -0,0 +1,92 @@
+import unittest
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog"] = MagicMock()
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from metrics_aggregator import MetricsAggregator
+
+
+class TestMetricsAggregator(unittest.TestCase):
+    def test_aggregates_by_name_tags_and_time_bucket(self):
+        aggregator = MetricsAggregator(interval=10)
+        aggregator.add("a", 1, timestamp=1000, tags=["b:2", "a:1"])
+        aggregator.add("a", 2, timestamp=1009, tags=["a:1", "b:2"])
+        aggregator.add("a", 3, timestamp=1010, tags=["a:1", "b:2"])
+        aggregator.add("a", 4, timestamp=1000, tags=["a:1"])
+        aggregator.add("b", 5, timestamp=1000.5)
+        aggregator.add("b", 6, timestamp=1000.5)
+        self.assertEqual(
+            aggregator.get_distributions(),
+            [
+                {
+                    "metric": "a",
+                    "points": [(1000, [1, 2]), (1010, [3])],
+                    "tags": ["a:1", "b:2"],
+                },
+                {"metric": "a", "points": [(1000, [4])], "tags": ["a:1"]},
+                {"metric": "b", "points": [(1000, [5, 6])], "tags": []},
+            ],
+        )
+
+    def test_counts_are_summed_per_time_bucket(self):
+        aggregator = MetricsAggregator(interval=10)
+        aggregator.add_count("a", timestamp=1000, tags=["a:1"])
+        aggregator.add_count("a", 2, timestamp=1009, tags=["a:1"])
+        aggregator.add_count("a", timestamp=1010, tags=["a:1"])
+        self.assertEqual(
+            aggregator.get_counts(),
+            [
+                {
+                    "metric": "a",
+                    "points": [(1000, 3), (1010, 1)],
+                    "type": "count",
+                    "interval": 10,
+                    "tags": ["a:1"],
+                }
+            ],
+        )
+        self.assertEqual(aggregator.get_distributions(), [])
+
+    @patch("metrics_aggregator.MAX_SERIES_PER_REQUEST", 2)
+    @patch("metrics_aggregator.api")
+    def test_flush(self, api):
+        aggregator = MetricsAggregator(interval=10)
+        for i in range(3):
+            aggregator.add(f"metric.{i}", i, timestamp=1000)
+        aggregator.add_count("count", timestamp=1000)
+        aggregator.flush()
+        self.assertEqual(api.Distribution.send.call_count, 2)
+        api.Metric.send.assert_called_once()
+        self.assertEqual(len(aggregator), 0)
+
+        api.Distribution.send.reset_mock()
+        aggregator.flush()
+        api.Distribution.send.assert_not_called()
+
+    @patch("metrics_aggregator.lambda_stats")
+    @patch("metrics_aggregator.api")
+    def test_flush_failure_is_retried_and_reported(self, api, lambda_stats):
+        api.Distribution.send.side_effect = Exception("unavailable")
+        aggregator = MetricsAggregator(interval=10)
+        aggregator.add("a", 1, timestamp=1000)
+        aggregator.add("b", 1, timestamp=1000)
+        aggregator.flush()
+        self.assertEqual(len(aggregator), 0)
+        self.assertEqual(api.Distribution.send.call_count, 2)
+        lambda_stats.distribution.assert_called_once()
+        self.assertEqual(
+            lambda_stats.distribution.call_args[0],
+            ("aws.dd_forwarder.metrics_submission_failures", 2),
+        )
+
+        api.Distribution.send.side_effect = [Exception("unavailable"), None]
+        lambda_stats.distribution.reset_mock()
+        aggregator.add("a", 1, timestamp=1000)
+        aggregator.flush()
+        lambda_stats.distribution.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 import base64
+import copy
 import gzip
 import json
+import re
 from unittest.mock import MagicMock, patch
 import os
 import sys
@@ -25,7 +27,13 @@ env_patch = patch.dict(
 env_patch.start()
 from parsing import (
     awslogs_handler,
+    kinesis_awslogs_handler,
+    s3_handler,
+    sqs_handler,
     parse_event_source,
+    find_cloudwatch_source,
+    find_s3_source,
+    parse_event_type,
     parse_service_arn,
     separate_security_hub_findings,
     parse_aws_waf_logs,
@@ -33,10 +41,20 @@ from parsing import (
     get_state_machine_arn,
     get_lower_cased_lambda_function_name,
     get_structured_lines_for_s3_handler,
+    split_lines,
+    map_concurrently,
+    get_s3_object_size,
+    iter_cloudtrail_records,
+    split_multiline_records,
+    merge_multiline_log_events,
+    decode_awslogs_data,
+    LogEvent,
 )
+from enhanced_lambda_metrics import parse_platform_log_record
 from settings import (
     DD_CUSTOM_TAGS,
     DD_SOURCE,
+    DD_BATCH_ITEM_ID,
 )
 
 env_patch.stop()
@@ -337,6 +355,24 @@ class TestParseEventSource(unittest.TestCase):
         self.assertEqual(parse_event_source({"Records": ["logs-from-s3"]}, ""), "s3")
 
 
+class TestFindSource(unittest.TestCase):
+    def test_find_s3_source(self):
+        self.assertEqual(
+            find_s3_source(
+                "AWSLogs/123456779121/CloudTrail/us-east-1/2018/01/07/"
+                "123456779121_CloudTrail_us-east-1_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
+            ),
+            "cloudtrail",
+        )
+        self.assertEqual(find_s3_source("AWSLogs/0/WAFLogs/x.log.gz"), "waf")
+        self.assertEqual(find_s3_source("unknown.log"), "s3")
+
+    def test_find_cloudwatch_source(self):
+        self.assertEqual(find_cloudwatch_source("/aws/RDS/MySQL-instance"), "mysql")
+        self.assertEqual(find_cloudwatch_source("/myMSKLogGroup"), "msk")
+        self.assertEqual(find_cloudwatch_source(""), "cloudwatch")
+
+
 class TestParseServiceArn(unittest.TestCase):
     def test_elb_s3_key_invalid(self):
         self.assertEqual(
@@ -730,6 +766,506 @@ class TestAWSLogsHandler(unittest.TestCase):
         verify_as_json(metadata, options=NamerFactory.with_parameters("metadata"))
 
 
+class TestDecodeAwslogsData(unittest.TestCase):
+    def test_decode_awslogs_data(self):
+        payload = {"logGroup": "group", "logEvents": [{"message": "é" * 1000}]}
+        encoded = bytes(json.dumps(payload), "utf-8")
+        self.assertEqual(
+            decode_awslogs_data(base64.b64encode(gzip.compress(encoded))), payload
+        )
+        # Concatenated gzip members
+        members = gzip.compress(encoded[:100]) + gzip.compress(encoded[100:])
+        self.assertEqual(decode_awslogs_data(base64.b64encode(members)), payload)
+        # Zero padding
+        padded = gzip.compress(encoded) + b"\x00" * 8
+        self.assertEqual(decode_awslogs_data(base64.b64encode(padded)), payload)
+
+    def test_truncated_payloads_raise(self):
+        compressed = gzip.compress(b'{"logEvents": []}')
+        for truncated in [compressed[:-4], compressed + compressed[:10]]:
+            with self.assertRaises(EOFError):
+                decode_awslogs_data(base64.b64encode(truncated))
+
+
+class TestLogEvent(unittest.TestCase):
+    def test_message_decoded_once(self):
+        event = LogEvent({"id": "1", "message": '{"key": "value"}'})
+        with patch("parsing.json.loads", wraps=json.loads) as mock_loads:
+            self.assertEqual(event.get_json_message(), {"key": "value"})
+            self.assertIs(event.get_json_message(), event.get_json_message())
+            self.assertEqual(mock_loads.call_count, 1)
+
+            event["message"] = '{"key": "other value"}'
+            self.assertEqual(event.get_json_message(), {"key": "other value"})
+            self.assertEqual(mock_loads.call_count, 2)
+
+            for message in ["plain text", "[1, 2]", '{"truncated": ', {"k": "v"}]:
+                event["message"] = message
+                self.assertIsNone(event.get_json_message())
+            # Only the messages starting like a JSON object are decoded
+            self.assertEqual(mock_loads.call_count, 3)
+
+    def test_log_event_is_a_dict(self):
+        event = LogEvent({"id": "1", "message": "text"})
+        event.get_json_message()
+        self.assertEqual(json.loads(json.dumps(event)), event)
+        self.assertEqual(copy.deepcopy(event), event)
+
+
+class TestKinesisAwslogsHandler(unittest.TestCase):
+    def create_record(self, log_group, messages, log_stream="stream"):
+        data = {
+            "owner": "123456789012",
+            "logGroup": log_group,
+            "logStream": log_stream,
+            "logEvents": [
+                {"id": str(i), "timestamp": 1609556645000, "message": message}
+                for i, message in enumerate(messages)
+            ],
+        }
+        return {
+            "kinesis": {
+                "data": base64.b64encode(
+                    gzip.compress(bytes(json.dumps(data), "utf-8"))
+                )
+            }
+        }
+
+    @patch("parsing.CloudwatchLogGroupTagsCache.get")
+    def test_kinesis_records_decoded_concurrently_preserve_order(self, mock_cache_get):
+        mock_cache_get.return_value = []
+        event = {
+            "Records": [
+                self.create_record(
+                    f"/aws/group{i}", [f"message {i}.{j}" for j in range(3)]
+                )
+                for i in range(10)
+            ]
+        }
+        metadata = {"ddsource": "cloudwatch", "ddtags": "env:dev"}
+
+        for workers in [1, 4]:
+            with patch("parsing.DD_KINESIS_DECODE_WORKERS", workers):
+                logs = list(kinesis_awslogs_handler(event, None, metadata))
+            self.assertEqual(
+                [log["message"] for log in logs],
+                [f"message {i}.{j}" for i in range(10) for j in range(3)],
+            )
+            self.assertEqual(logs[-1]["aws"]["awslogs"]["logGroup"], "/aws/group9")
+
+    @patch("parsing.account_step_functions_tags_cache")
+    @patch("parsing.CloudwatchLogGroupTagsCache.get")
+    def test_kinesis_state_machine_tags_prefetched(
+        self, mock_cache_get, mock_step_functions_cache
+    ):
+        mock_cache_get.return_value = []
+        mock_step_functions_cache.should_fetch_tags.return_value = True
+        mock_step_functions_cache.get.return_value = ["env:staging"]
+        execution_arn = "arn:aws:states:us-east-1:0:express:machine-{}:exec:1"
+        event = {
+            "Records": [
+                self.create_record(
+                    "/aws/vendedlogs/states/machine",
+                    [json.dumps({"execution_arn": execution_arn.format(i)})],
+                    log_stream="states/machine/2024-01-01",
+                )
+                for i in range(3)
+            ]
+            + [{"kinesis": {"data": "invalid", "sequenceNumber": "4"}}]
+        }
+        metadata = {"ddsource": "cloudwatch", "ddtags": "env:dev"}
+        failed_item_ids = []
+
+        with patch("parsing.DD_KINESIS_DECODE_WORKERS", 4):
+            logs = list(kinesis_awslogs_handler(event, None, metadata, failed_item_ids))
+        mock_step_functions_cache.prefetch.assert_called_once_with(
+            [f"arn:aws:states:us-east-1:0:stateMachine:machine-{i}" for i in range(3)]
+        )
+        self.assertEqual(len(logs), 3)
+        self.assertEqual(failed_item_ids, ["4"])
+
+        # The tags are prefetched by chunk of records decoded ahead
+        mock_step_functions_cache.prefetch.reset_mock()
+        with patch("parsing.DD_KINESIS_DECODE_WORKERS", 2):
+            records = kinesis_awslogs_handler(event, None, metadata)
+            next(records)
+            mock_step_functions_cache.prefetch.assert_called_once_with(
+                [
+                    f"arn:aws:states:us-east-1:0:stateMachine:machine-{i}"
+                    for i in range(2)
+                ]
+            )
+            records.close()
+
+
+class TestS3AndSQSHandlers(unittest.TestCase):
+    def s3_notification(self, *keys):
+        return json.dumps(
+            {
+                "Records": [
+                    {
+                        "eventSource": "aws:s3",
+                        "s3": {
+                            "bucket": {"name": "my-bucket"},
+                            "object": {"key": key},
+                        },
+                    }
+                    for key in keys
+                ]
+            }
+        )
+
+    def sqs_event(self, *bodies):
+        return {
+            "Records": [
+                {"messageId": f"id-{i}", "eventSource": "aws:sqs", "body": body}
+                for i, body in enumerate(bodies)
+            ]
+        }
+
+    def get_object(self, Bucket, Key):
+        if Key == "missing.log":
+            raise Exception("NoSuchKey")
+        body = MagicMock()
+        body.read.return_value = gzip.compress(
+            bytes(f"{Key} line 1\n{Key} line 2\n", "utf-8")
+        )
+        return {"Body": body}
+
+    def setUp(self):
+        s3_client = MagicMock()
+        s3_client.get_object.side_effect = self.get_object
+        patcher = patch("parsing.get_s3_client", return_value=s3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_event_type(self):
+        self.assertEqual(parse_event_type(self.sqs_event("hello")), "sqs")
+
+    @patch("parsing.DD_S3_RANGED_GET_THRESHOLD", 10)
+    @patch("parsing.DD_S3_RANGED_GET_PART_SIZE", 7)
+    def test_large_objects_are_fetched_as_ranges(self):
+        data = b"first line\r\nsecond line\rthird line\n\nlast line"
+        s3_client = MagicMock()
+
+        def get_object(Bucket, Key, Range, IfMatch=None):
+            start, end = map(int, Range[len("bytes=") :].split("-"))
+            self.assertEqual(IfMatch, None if start == 0 else '"etag"')
+            body = MagicMock()
+            body.read.return_value = data[start : end + 1]
+            return {"Body": body, "ETag": '"etag"'}
+
+        s3_client.get_object.side_effect = get_object
+        notification = json.loads(self.s3_notification("big.log"))
+        notification["Records"][0]["s3"]["object"]["size"] = len(data)
+        metadata = {DD_SOURCE: "", DD_CUSTOM_TAGS: ""}
+
+        for workers in [1, 4]:
+            with patch("parsing.get_s3_client", return_value=s3_client), patch(
+                "parsing.DD_S3_FETCH_WORKERS", workers
+            ):
+                logs = list(s3_handler(notification, None, metadata))
+            self.assertEqual(
+                [log["message"] for log in logs], data.decode().splitlines()
+            )
+        self.assertEqual(s3_client.get_object.call_count, 2 * 7)
+
+    @patch("parsing.DD_S3_RANGED_GET_THRESHOLD", 10)
+    def test_objects_fetched_as_ranges_are_not_prefetched(self):
+        self.assertEqual(get_s3_object_size(("my-bucket", "big.log", 100)), 0)
+        self.assertEqual(get_s3_object_size(("my-bucket", "big.log.gz", 100)), 100)
+        self.assertEqual(get_s3_object_size(("my-bucket", "small.log", 10)), 10)
+        self.assertEqual(get_s3_object_size(("my-bucket", "unknown.log", None)), 0)
+
+    def test_s3_handler_parses_all_records(self):
+        event = json.loads(self.s3_notification("a.log", "b.log"))
+        sns_event = {
+            "Records": [
+                {"Sns": {"Message": self.s3_notification("c.log")}},
+                {"Sns": {"Message": self.s3_notification("d.log")}},
+            ]
+        }
+        metadata = {DD_SOURCE: "", DD_CUSTOM_TAGS: ""}
+
+        for workers in [1, 4]:
+            with patch("parsing.DD_S3_FETCH_WORKERS", workers):
+                logs = list(s3_handler(event, None, metadata))
+                sns_logs = list(s3_handler(sns_event, None, metadata))
+            self.assertEqual(
+                [log["aws"]["s3"]["key"] for log in logs],
+                ["a.log", "a.log", "b.log", "b.log"],
+            )
+            self.assertEqual(
+                [log["aws"]["s3"]["key"] for log in sns_logs],
+                ["c.log", "c.log", "d.log", "d.log"],
+            )
+
+    def test_s3_notifications_in_sqs_and_sns_envelopes(self):
+        sns_envelope = json.dumps(
+            {"Type": "Notification", "Message": self.s3_notification("c.log")}
+        )
+        event = self.sqs_event(
+            self.s3_notification("a.log", "b.log"),
+            sns_envelope,
+            json.dumps({"Event": "s3:TestEvent"}),
+            "plain message",
+        )
+        metadata = {DD_SOURCE: "", DD_CUSTOM_TAGS: "env:dev"}
+
+        for workers in [1, 4]:
+            with patch("parsing.DD_S3_FETCH_WORKERS", workers):
+                logs = list(sqs_handler(event, None, metadata))
+            self.assertEqual(
+                [log["message"] for log in logs],
+                [
+                    "a.log line 1",
+                    "a.log line 2",
+                    "b.log line 1",
+                    "b.log line 2",
+                    "c.log line 1",
+                    "c.log line 2",
+                    "plain message",
+                ],
+            )
+            self.assertEqual(logs[0]["aws"]["s3"]["key"], "a.log")
+            self.assertEqual(logs[-1]["aws"]["sqs"]["messageId"], "id-3")
+        self.assertEqual(metadata[DD_SOURCE], "sqs")
+
+    def test_failed_messages_are_reported(self):
+        event = self.sqs_event(
+            self.s3_notification("missing.log"), self.s3_notification("a.log")
+        )
+        metadata = {DD_SOURCE: "", DD_CUSTOM_TAGS: ""}
+
+        failed_item_ids = []
+        logs = list(sqs_handler(event, None, metadata, failed_item_ids))
+        self.assertEqual(failed_item_ids, ["id-0"])
+        self.assertEqual([log[DD_BATCH_ITEM_ID] for log in logs], ["id-1", "id-1"])
+
+        with self.assertRaises(Exception):
+            list(sqs_handler(event, None, metadata))
+
+    def test_failed_messages_are_not_partially_forwarded(self):
+        event = self.sqs_event(
+            self.s3_notification("a.log", "missing.log"), self.s3_notification("a.log")
+        )
+        metadata = {DD_SOURCE: "", DD_CUSTOM_TAGS: ""}
+
+        failed_item_ids = []
+        logs = list(sqs_handler(event, None, metadata, failed_item_ids))
+        self.assertEqual(failed_item_ids, ["id-0"])
+        self.assertEqual([log[DD_BATCH_ITEM_ID] for log in logs], ["id-1", "id-1"])
+
+
+class TestMapConcurrently(unittest.TestCase):
+    def test_pending_size_is_bounded(self):
+        pulled = []
+
+        def items():
+            for size in [10, 10, 10, 30, 10]:
+                pulled.append(size)
+                yield size
+
+        results = map_concurrently(
+            lambda size: size * 2, items(), 4, max_pending_size=25, size_of=int
+        )
+        self.assertEqual(next(results)(), 20)
+        # the third item isn't fetched until the first one is consumed
+        self.assertEqual(len(pulled), 3)
+        self.assertEqual([result() for result in results], [20, 20, 60, 20])
+
+    def test_large_items_are_computed_alone(self):
+        results = map_concurrently(
+            lambda size: size, [100, 100], 4, max_pending_size=25, size_of=int
+        )
+        self.assertEqual([result() for result in results], [100, 100])
+
+
+class TestSplitLines(unittest.TestCase):
+    def chunks(self, data, size):
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
+    def test_split_lines_like_splitlines(self):
+        data = "a\r\nb\rc\n\nd\fe\u2028é\r\r\nf\n".encode("utf-8")
+        for size in range(1, len(data) + 1):
+            self.assertEqual(
+                list(split_lines(self.chunks(data, size))),
+                data.decode("utf-8").splitlines(),
+            )
+            self.assertEqual(
+                list(split_lines(self.chunks(data[:-1], size))),
+                data[:-1].decode("utf-8").splitlines(),
+            )
+
+    def test_split_lines_on_separator(self):
+        data = b"a\n\nb\rc\n\nd"
+        for size in range(1, len(data) + 1):
+            self.assertEqual(
+                list(split_lines(self.chunks(data, size), "\n")), ["a", "b\rc", "d"]
+            )
+
+
+class TestSplitMultilineRecords(unittest.TestCase):
+    def chunks(self, data, size):
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
+    @patch(
+        "parsing.multiline_regex_start_pattern",
+        re.compile(r"^\d{4}-\d{2}-\d{2}"),
+        create=True,
+    )
+    def test_records_split_like_multiline_regex(self):
+        data = (
+            "2023-01-01 ERROR failed\n"
+            "Traceback:\r\n  File é\n\n"
+            "2023-01-01 INFO ok\f"
+            "2023-01-02 INFO last\n  continued\n\n"
+        )
+        expected = re.split(r"[\n\r\f]+(?=\d{4}-\d{2}-\d{2})", data)
+        encoded = data.encode("utf-8")
+        for size in range(1, len(encoded) + 1):
+            self.assertEqual(
+                list(split_multiline_records(self.chunks(encoded, size))), expected
+            )
+
+    @patch("parsing.multiline_regex_start_pattern", re.compile(r"^START"), create=True)
+    def test_records_are_cut_at_max_record_size(self):
+        data = b"START 1\nline a\nline b\nline c\nSTART 2\n"
+        self.assertEqual(
+            list(split_multiline_records(self.chunks(data, 3), max_record_size=16)),
+            ["START 1\nline a", "line b\nline c", "START 2\n"],
+        )
+
+    @patch("parsing.multiline_regex_start_pattern", re.compile(r"^START"), create=True)
+    def test_long_lines_are_split(self):
+        data = b"START 1\n" + b"x" * 40 + b"\nSTART 2\n"
+        for size in range(1, len(data) + 1):
+            self.assertEqual(
+                list(
+                    split_multiline_records(self.chunks(data, size), max_record_size=16)
+                ),
+                ["START 1", "x" * 16, "x" * 16, "x" * 8, "START 2\n"],
+            )
+
+
+class TestMergeMultilineLogEvents(unittest.TestCase):
+    def log_events(self, *messages):
+        return [
+            {"id": str(i), "timestamp": 1609556645000 + i, "message": message}
+            for i, message in enumerate(messages)
+        ]
+
+    @patch(
+        "parsing.cloudwatch_multiline_regex_start_pattern",
+        re.compile(r"^\[(ERROR|INFO)\]"),
+        create=True,
+    )
+    def test_continuation_lines_are_merged(self):
+        log_events = self.log_events(
+            "START RequestId: 1 Version: $LATEST\n",
+            "Traceback (most recent call last):\n",
+            "[ERROR] Exception: failed\n",
+            "Traceback (most recent call last):\n",
+            '  File "/var/task/handler.py", line 4\n',
+            "[INFO] ok\n",
+            "END RequestId: 1\n",
+            "  after the end\n",
+            "REPORT RequestId: 1\tDuration: 1.00 ms\n",
+        )
+
+        merged = list(merge_multiline_log_events(log_events))
+
+        self.assertEqual(
+            [(log["id"], log["message"]) for log in merged],
+            [
+                ("0", "START RequestId: 1 Version: $LATEST\n"),
+                ("1", "Traceback (most recent call last):\n"),
+                (
+                    "2",
+                    "[ERROR] Exception: failed\n"
+                    "Traceback (most recent call last):\n"
+                    '  File "/var/task/handler.py", line 4',
+                ),
+                ("5", "[INFO] ok\n"),
+                ("6", "END RequestId: 1\n"),
+                ("7", "  after the end\n"),
+                ("8", "REPORT RequestId: 1\tDuration: 1.00 ms\n"),
+            ],
+        )
+
+    @patch(
+        "parsing.cloudwatch_multiline_regex_start_pattern",
+        re.compile(r'^{"timestamp"'),
+        create=True,
+    )
+    def test_json_platform_records_are_not_merged(self):
+        platform_report = json.dumps(
+            {
+                "time": "2023-11-14T22:01:05.000Z",
+                "type": "platform.report",
+                "record": {
+                    "requestId": "1",
+                    "metrics": {"durationMs": 0.62, "billedDurationMs": 100},
+                },
+            }
+        )
+        log_events = self.log_events(
+            '{"timestamp": "2023-11-14T22:01:04.000Z", "level": "ERROR"}\n',
+            "  at handler\n",
+            platform_report + "\n",
+        )
+
+        merged = list(merge_multiline_log_events(log_events))
+
+        self.assertEqual([log["id"] for log in merged], ["0", "2"])
+        self.assertEqual(
+            parse_platform_log_record(merged[1]["message"])["type"], "platform.report"
+        )
+
+    @patch(
+        "parsing.cloudwatch_multiline_regex_start_pattern",
+        re.compile("^E"),
+        create=True,
+    )
+    @patch("parsing.DD_CLOUDWATCH_MULTILINE_LOG_MAX_LINES", 3)
+    def test_merged_logs_are_capped(self):
+        log_events = self.log_events("E", "a", "b", "c", "d")
+        self.assertEqual(
+            [log["message"] for log in merge_multiline_log_events(log_events)],
+            ["E\na\nb", "c\nd"],
+        )
+
+
+class TestIterCloudtrailRecords(unittest.TestCase):
+    def chunks(self, data, size):
+        return [data[i : i + size] for i in range(0, len(data), size)]
+
+    def test_records_parsed_across_chunks(self):
+        records = [
+            {"eventName": "DescribeTable", "requestParameters": {"tableName": "é"}},
+            {"eventName": "GetObject", "resources": [{"ARN": "arn"}], "n": 1.5},
+            {},
+        ]
+        data = json.dumps({"Records": records}, indent=1, ensure_ascii=False).encode(
+            "utf-8"
+        )
+        for size in range(1, len(data) + 1):
+            self.assertEqual(
+                list(iter_cloudtrail_records(self.chunks(data, size))), records
+            )
+
+    def test_other_files_are_not_parsed(self):
+        for data in [b"", b'{"Records": {}}', b'{"Digest": 1, "Records": []}']:
+            self.assertEqual(list(iter_cloudtrail_records(self.chunks(data, 4))), [])
+
+    def test_truncated_files_raise(self):
+        data = b'{"Records": [{"eventName": "a"}, {"eventName": "b"'
+        records = iter_cloudtrail_records(self.chunks(data, 4))
+        self.assertEqual(next(records), {"eventName": "a"})
+        with self.assertRaises(ValueError):
+            next(records)
+
+
 class TestGetServiceFromTags(unittest.TestCase):
     def test_get_service_from_tags(self):
         metadata = {
@@ -849,6 +1385,83 @@ class TestS3EventsHandler(unittest.TestCase):
             ],
         )
 
+    @patch("parsing.DD_PARSE_S3_LOG_COLUMNS", True)
+    def test_get_structured_lines_columns(self):
+        alb_line = (
+            "https 2018-07-02T22:23:00.186641Z app/my-lb/50dc6c495c0c9188 "
+            "192.168.131.39:2817 10.0.0.1:80 0.086 0.048 0.037 200 200 0 57 "
+            '"GET https://www.example.com:443/ HTTP/1.1" "curl/7.46.0" '
+            "ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 "
+            "arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/tg/73e2d6bc24d8a067 "
+            '"Root=1-58337281-1d84f3d73c47ec4e58577259" "www.example.com" '
+            '"arn:aws:acm:us-east-2:123456789012:certificate/12345678" 1 '
+            '2018-07-02T22:22:48.364000Z "authenticate,forward" "-" "-" '
+            '"10.0.0.1:80" "200" "-" "-" TID_123'
+        )
+        alb_logs = self.parse_lines(
+            alb_line + "\n", "elasticloadbalancing/x.log", "elb"
+        )
+        self.assertEqual(
+            alb_logs[0]["message"]["request"],
+            "GET https://www.example.com:443/ HTTP/1.1",
+        )
+        self.assertEqual(alb_logs[0]["message"]["conn_trace_id"], "TID_123")
+        self.assertNotIn("redirect_url", alb_logs[0]["message"])
+
+        cloudfront_data = (
+            "#Version: 1.0\n"
+            "#Fields: date time x-edge-location sc-bytes cs(Referer)\n"
+            "2019-12-04\t21:02:31\tLAX1\t392\t-\n"
+        )
+        self.assertEqual(
+            [
+                log["message"]
+                for log in self.parse_lines(cloudfront_data, "cf.gz", "cloudfront")
+            ],
+            [
+                {
+                    "date": "2019-12-04",
+                    "time": "21:02:31",
+                    "x-edge-location": "LAX1",
+                    "sc-bytes": "392",
+                }
+            ],
+        )
+
+        vpc_data = (
+            "version account-id srcaddr action log-status\n"
+            "2 123456789010 172.31.16.139 ACCEPT OK\n"
+        )
+        self.assertEqual(
+            [log["message"] for log in self.parse_lines(vpc_data, "vpc.gz", "vpc")],
+            [
+                {
+                    "version": "2",
+                    "account-id": "123456789010",
+                    "srcaddr": "172.31.16.139",
+                    "action": "ACCEPT",
+                    "log-status": "OK",
+                }
+            ],
+        )
+
+    @patch("parsing.lambda_stats")
+    def test_truncated_cloudtrail_files_are_reported(self, mock_lambda_stats):
+        key = (
+            "123456779121_CloudTrail_eu-west-3_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
+        )
+        data = '{"Records": [{"eventName": "a"}, {"eventName": "b"}, {"eventNa'
+
+        with self.assertLogs("root", level="ERROR") as logs:
+            lines = self.parse_lines(data, key, "cloudtrail")
+
+        self.assertEqual([line["eventName"] for line in lines], ["a", "b"])
+        self.assertIn(f"s3://my-bucket/{key}", logs.output[0])
+        self.assertEqual(
+            mock_lambda_stats.distribution.call_args[0][0],
+            "aws.dd_forwarder.cloudtrail_parse_failures",
+        )
+
     def test_get_structured_lines_cloudtrail(self):
         key = (
             "123456779121_CloudTrail_eu-west-3_20180707T1735Z_abcdefghi0MCRL2O.json.gz"
@@ -0,0 +1,56 @@
+import unittest
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from sampling import SamplingRule, TokenBucket, parse_sampling_rules, sample_logs
+
+
+class TestSampleLogs(unittest.TestCase):
+    def logs(self, source, count):
+        return [
+            {"id": f"{source}-{i}", "ddsource": source, "message": "hello"}
+            for i in range(count)
+        ]
+
+    def test_logs_matching_no_rule_are_kept(self):
+        logs = self.logs("lambda", 10)
+        self.assertEqual(sample_logs(logs, []), logs)
+        self.assertEqual(
+            sample_logs(logs, [SamplingRule(source="s3", sample_rate=0)]), logs
+        )
+
+    def test_sampling_is_deterministic(self):
+        rules = parse_sampling_rules('[{"source": "lambda", "sample_rate": 0.25}]')
+        logs = self.logs("lambda", 1000) + self.logs("s3", 10)
+
+        kept_logs = sample_logs(logs, rules)
+
+        self.assertEqual(kept_logs, sample_logs(logs, rules))
+        self.assertEqual(kept_logs[-10:], logs[-10:])
+        self.assertAlmostEqual(len(kept_logs) - 10, 250, delta=50)
+
+    @patch("sampling.monotonic")
+    def test_rate_limit(self, monotonic):
+        monotonic.return_value = 0
+        rules = [SamplingRule(log_group="/aws/lambda/noisy", rate_limit=2, burst=5)]
+        logs = [{"aws": {"awslogs": {"logGroup": "/aws/lambda/noisy"}}}] * 10
+
+        self.assertEqual(len(sample_logs(logs, rules)), 5)
+        monotonic.return_value = 1
+        self.assertEqual(len(sample_logs(logs, rules)), 2)
+
+    def test_token_bucket_is_capped_at_burst(self):
+        with patch("sampling.monotonic", return_value=0):
+            bucket = TokenBucket(10, 3)
+        with patch("sampling.monotonic", return_value=100):
+            self.assertEqual([bucket.consume() for _ in range(4)], [True] * 3 + [False])
+
+    def test_invalid_rules(self):
+        with self.assertRaises(Exception):
+            parse_sampling_rules('[{"sample": 0.1}]')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+sys.modules["datadog_lambda.metric"] = MagicMock()
+
+from step_functions_cache import StepFunctionsTagsCache, get_state_machines_tags
+
+
+def get_resources(ResourceARNList):
+    # Only the even state machines are tagged
+    return {
+        "ResourceTagMappingList": [
+            {"ResourceARN": arn, "Tags": [{"Key": "ENV", "Value": "staging"}]}
+            for arn in ResourceARNList
+            if int(arn.rsplit("-", 1)[-1]) % 2 == 0
+        ]
+    }
+
+
+@patch.dict(os.environ, {"DD_FETCH_STEP_FUNCTIONS_TAGS": "true"})
+@patch("step_functions_cache.send_forwarder_internal_metrics", MagicMock())
+@patch("step_functions_cache.resource_tagging_client")
+class TestStepFunctionsTagsCache(unittest.TestCase):
+    arn_prefix = "arn:aws:states:us-east-1:0:stateMachine:machine-"
+
+    def setUp(self):
+        self.cache = StepFunctionsTagsCache()
+        # Not expired
+        self.cache.last_tags_fetch_time = float("inf")
+
+    def test_prefetch_batches_get_resources_calls(self, resource_tagging_client):
+        resource_tagging_client.get_resources.side_effect = get_resources
+        arns = [f"{self.arn_prefix}{i}" for i in range(150)]
+        self.cache.prefetch(arns + arns[:10] + [""])
+
+        self.assertEqual(resource_tagging_client.get_resources.call_count, 2)
+        batch_sizes = [
+            len(call.kwargs["ResourceARNList"])
+            for call in resource_tagging_client.get_resources.call_args_list
+        ]
+        self.assertEqual(batch_sizes, [100, 50])
+        self.assertEqual(self.cache.get(arns[0]), ["env:staging"])
+        # The state machines without tags are cached as well
+        self.assertEqual(self.cache.get(arns[1]), [])
+        self.cache.prefetch(arns)
+        self.assertEqual(resource_tagging_client.get_resources.call_count, 2)
+
+    def test_get_fetches_missing_state_machine(self, resource_tagging_client):
+        resource_tagging_client.get_resources.side_effect = get_resources
+        self.assertEqual(self.cache.get(f"{self.arn_prefix}2"), ["env:staging"])
+        self.assertEqual(self.cache.get(f"{self.arn_prefix}2"), ["env:staging"])
+        resource_tagging_client.get_resources.assert_called_once()
+        self.assertEqual(self.cache.get(""), [])
+        resource_tagging_client.get_resources.assert_called_once()
+
+    def test_get_state_machines_tags(self, resource_tagging_client):
+        resource_tagging_client.get_resources.side_effect = get_resources
+        arns = [f"{self.arn_prefix}{i}" for i in range(3)]
+        self.assertEqual(
+            get_state_machines_tags(arns),
+            {arns[0]: ["env:staging"], arns[2]: ["env:staging"]},
+        )
+
+    def test_get_state_machines_tags_failure(self, resource_tagging_client):
+        resource_tagging_client.get_resources.side_effect = Exception("throttled")
+        self.assertIsNone(get_state_machines_tags([f"{self.arn_prefix}2"]))
+
+    def test_prefetch_failures_back_off(self, resource_tagging_client):
+        resource_tagging_client.get_resources.side_effect = Exception("throttled")
+        arn = f"{self.arn_prefix}2"
+        self.assertEqual(self.cache.get(arn), [])
+        self.assertEqual(self.cache.get(arn), [])
+        resource_tagging_client.get_resources.assert_called_once()
+
+        self.cache.entries[arn].fetched_at -= 3600
+        resource_tagging_client.get_resources.side_effect = get_resources
+        self.assertEqual(self.cache.get(arn), ["env:staging"])
+        self.assertEqual(resource_tagging_client.get_resources.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
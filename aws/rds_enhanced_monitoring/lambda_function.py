@@ -2,14 +2,13 @@
 # under the Apache License Version 2.0.
 # This product includes software developed at Datadog (https://www.datadoghq.com/).
 # Copyright 2021 Datadog, Inc.
-import gzip
+import zlib
 import json
 import os
 import re
 import time
 import base64
 import random
-from io import BufferedReader, BytesIO
 from urllib.error import HTTPError
 from urllib.request import Request, urlopen
 from urllib.parse import urlencode
@@ -273,17 +272,28 @@ def extract_json_objects(input_string):
     return json_objects
 
 
+def decode_awslogs_data(data):
+    """Decode the base64 encoded and gzipped payload of a CloudWatch Logs subscription"""
+    compressed = base64.b64decode(data)
+    decompressed = []
+    while compressed:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressed.append(decompressor.decompress(compressed))
+        if not decompressor.eof:
+            raise EOFError(
+                "Compressed file ended before the end-of-stream marker was reached"
+            )
+        # Like gzip, skip the zero padding that may follow a member
+        compressed = decompressor.unused_data.lstrip(b"\x00")
+    return json.loads(b"".join(decompressed))
+
+
 def lambda_handler(event, context):
     """Process a RDS enhanced monitoring DATA_MESSAGE,
     coming from CLOUDWATCH LOGS
     """
     # event is a dict containing a base64 string gzipped
-    with gzip.GzipFile(
-        fileobj=BytesIO(base64.b64decode(event["awslogs"]["data"]))
-    ) as decompress_stream:
-        data = b"".join(BufferedReader(decompress_stream))
-
-    event = json.loads(data)
+    event = decode_awslogs_data(event["awslogs"]["data"])
 
     account = event["owner"]
     region = context.invoked_function_arn.split(":", 4)[3]
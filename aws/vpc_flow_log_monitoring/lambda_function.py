@@ -4,11 +4,10 @@
 # Copyright 2021 Datadog, Inc.
 import logging
 import os
-import gzip
+import zlib
 import json
 import time
 import base64
-from io import BufferedReader, BytesIO
 from collections import defaultdict, Counter
 from urllib.request import Request, urlopen
 from urllib.parse import urlencode
@@ -428,14 +427,25 @@ class Stats(object):
 stats = Stats()
 
 
+def decode_awslogs_data(data):
+    """Decode the base64 encoded and gzipped payload of a CloudWatch Logs subscription"""
+    compressed = base64.b64decode(data)
+    decompressed = []
+    while compressed:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressed.append(decompressor.decompress(compressed))
+        if not decompressor.eof:
+            raise EOFError(
+                "Compressed file ended before the end-of-stream marker was reached"
+            )
+        # Like gzip, skip the zero padding that may follow a member
+        compressed = decompressor.unused_data.lstrip(b"\x00")
+    return json.loads(b"".join(decompressed))
+
+
 def lambda_handler(event, context):
     # event is a dict containing a base64 string gzipped
-    with gzip.GzipFile(
-        fileobj=BytesIO(base64.b64decode(event["awslogs"]["data"]))
-    ) as decompress_stream:
-        data = b"".join(BufferedReader(decompress_stream))
-
-    event = json.loads(data)
+    event = decode_awslogs_data(event["awslogs"]["data"])
     function_arn = context.invoked_function_arn
     # 'arn:aws:lambda:us-east-1:1234123412:function:VPCFlowLogs'
     region, account = function_arn.split(":", 5)[3:5]